@@ -0,0 +1,32 @@
+import pickle
+import zlib
+
+from django.core.cache.backends.redis import RedisSerializer
+
+
+class CompressedRedisSerializer(RedisSerializer):
+    """
+    Сериализатор кэша Redis, сжимающий большие значения (например, данные графиков) через zlib.
+
+    Целые числа хранятся как есть, чтобы работали incr/decr.
+    """
+
+    MIN_COMPRESS_LENGTH = 1024
+    COMPRESSED_MARKER = b'z'
+
+    def dumps(self, obj):
+        data = super().dumps(obj)
+
+        if isinstance(data, bytes) and len(data) >= self.MIN_COMPRESS_LENGTH:
+            return self.COMPRESSED_MARKER + zlib.compress(data)
+
+        return data
+
+    def loads(self, data):
+        try:
+            return int(data)
+        except ValueError:
+            if data[:1] == self.COMPRESSED_MARKER:
+                data = zlib.decompress(data[1:])
+
+            return pickle.loads(data)
@@ -1,3 +1,4 @@
+import json
 import os
 from celery import Celery
 
@@ -12,6 +13,8 @@ app.autodiscover_tasks()
 def setup_periodic_tasks(sender: Celery, **kwargs):
     from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
+    from api.models import Notification
+
     schedule, _ = CrontabSchedule.objects.get_or_create(
         hour='*',
         minute='*/5',
@@ -20,16 +23,72 @@ def setup_periodic_tasks(sender: Celery, **kwargs):
         month_of_year='*',
     )
 
-    PeriodicTask.objects.create(
+    minute_schedule, _ = CrontabSchedule.objects.get_or_create(
+        hour='*',
+        minute='*',
+        day_of_week='*',
+        day_of_month='*',
+        month_of_year='*',
+    )
+
+    daily_schedule, _ = CrontabSchedule.objects.get_or_create(
+        hour='3',
+        minute='0',
+        day_of_week='*',
+        day_of_month='*',
+        month_of_year='*',
+    )
+
+    PeriodicTask.objects.update_or_create(
         name='update-currency-rates',
-        task='app.tasks.update_currency_rates',
-        crontab=schedule,
-        enabled=True
+        defaults={
+            'task': 'app.tasks.update_currency_rates',
+            'crontab': schedule,
+            'enabled': True
+        }
     )
 
-    PeriodicTask.objects.create(
+    PeriodicTask.objects.update_or_create(
         name='update-portfolio-values',
-        task='api.tasks.update_portfolio_values',
-        crontab=schedule,
-        enabled=True
+        defaults={
+            'task': 'api.tasks.update_portfolio_values',
+            'crontab': schedule,
+            'enabled': True
+        }
     )
+
+    PeriodicTask.objects.update_or_create(
+        name='maintain-partitions',
+        defaults={
+            'task': 'api.tasks.maintain_partitions',
+            'crontab': daily_schedule,
+            'enabled': True
+        }
+    )
+
+    PeriodicTask.objects.update_or_create(
+        name='dispatch-watch-notifications',
+        defaults={
+            'task': 'api.tasks.dispatch_watch_notifications',
+            'crontab': minute_schedule,
+            'enabled': True
+        }
+    )
+
+    # Добирают отложенные повторы и сообщения, для которых не сработал on_commit.
+    # Канал передаётся явно, чтобы доставка в Telegram ушла в свою очередь
+    for channel in Notification.Channel:
+        PeriodicTask.objects.update_or_create(
+            name=f'deliver-{channel.value.lower()}-notifications',
+            defaults={
+                'task': 'api.tasks.deliver_notifications',
+                'crontab': minute_schedule,
+                'args': json.dumps([channel.value]),
+                'enabled': True
+            }
+        )
+
+    PeriodicTask.objects.filter(name='deliver-notifications').delete()
+
+    # Задачи notify-<id> на каждое отслеживание заменены общей рассылкой
+    PeriodicTask.objects.filter(task='api.tasks.notify_currency_rate').delete()
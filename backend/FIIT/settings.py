@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from datetime import timedelta
 from pathlib import Path
+from urllib.parse import quote
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -33,6 +35,7 @@ CSRF_TRUSTED_ORIGINS = [f'http://{host}:8000' for host in ALLOWED_HOSTS]
 
 API_URL = os.getenv('SITE_API_URL')
 PORTFOLIO_BALANCE = int(os.getenv('SITE_PORTFOLIO_BALANCE'))
+PORTFOLIO_VALUE_EPSILON = float(os.getenv('SITE_PORTFOLIO_VALUE_EPSILON') or 0.01)
 
 # Application definition
 
@@ -175,6 +178,7 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERY_TASK_ROUTES = ('api.tasks.route_notifications',)
 
 USE_DEPRECATED_PYTZ = True
 
@@ -186,6 +190,11 @@ EMAIL_USE_SSL = bool(os.getenv('EMAIL_USE_SSL'))
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT') or 30)
+# Каталог писем для django.core.mail.backends.filebased.EmailBackend (локальные замеры без SMTP)
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH') or BASE_DIR / 'sent_emails'
+# Сколько писем отправляется через одно SMTP-соединение, прежде чем оно переоткрывается
+EMAIL_MESSAGES_PER_CONNECTION = int(os.getenv('EMAIL_MESSAGES_PER_CONNECTION') or 100)
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -237,13 +246,62 @@ STATICFILES_DIRS = [
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Cache settings
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Общий кэш в Redis для всех воркеров gunicorn и Celery, LocMemCache для тестов и без Redis
+REDIS_HOST = os.getenv('REDIS_HOST')
+REDIS_PORT = os.getenv('REDIS_PORT') or 6379
+REDIS_DB = os.getenv('REDIS_DB') or 0
+REDIS_USER = os.getenv('REDIS_USER') or ''
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD') or ''
+
+CACHE_VERSION = int(os.getenv('DJANGO_CACHE_VERSION') or 1)
+
+if REDIS_HOST and 'test' not in sys.argv:
+    REDIS_CREDENTIALS = f'{quote(REDIS_USER)}:{quote(REDIS_PASSWORD)}@' if REDIS_PASSWORD else ''
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f'redis://{REDIS_CREDENTIALS}{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+            'KEY_PREFIX': 'fiit',
+            'VERSION': CACHE_VERSION,
+            'OPTIONS': {
+                'serializer': 'FIIT.cache.CompressedRedisSerializer',
+                'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS') or 50),
+                'socket_connect_timeout': 5,
+                'socket_timeout': 5,
+                'health_check_interval': 30,
+            },
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+            'VERSION': CACHE_VERSION,
+        }
+    }
+
+# Partitioning settings
+# Срок хранения секций в месяцах, пусто - хранить всю историю
+RATE_RETENTION_MONTHS = int(os.getenv('RATE_RETENTION_MONTHS')) if os.getenv('RATE_RETENTION_MONTHS') else None
+PORTFOLIO_VALUE_RETENTION_MONTHS = (int(os.getenv('PORTFOLIO_VALUE_RETENTION_MONTHS'))
+                                    if os.getenv('PORTFOLIO_VALUE_RETENTION_MONTHS') else None)
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD') or 3)
+PARTITION_DETACH_ONLY = bool(os.getenv('PARTITION_DETACH_ONLY'))
+
+# Rates settings
+BINANCE_KLINE_INTERVAL = os.getenv('BINANCE_KLINE_INTERVAL') or '1d'
+RATES_PAGE_SIZE = int(os.getenv('RATES_PAGE_SIZE') or 500)
+RATES_MAX_PAGE_SIZE = int(os.getenv('RATES_MAX_PAGE_SIZE') or 5000)
 
 # Telegram Bot settings
 TELEGRAM_BOT_USERNAME = os.getenv('TELEGRAM_BOT_USERNAME')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Лимиты Bot API: около 30 сообщений в секунду на бота и 1 в секунду на чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE') or 30)
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE') or 1)
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv('TELEGRAM_MAX_CONNECTIONS') or 100)
+# Лимит корзины действует в одном процессе, поэтому доставку в Telegram выполняет
+# отдельный воркер этой очереди с --concurrency 1
+TELEGRAM_QUEUE = os.getenv('TELEGRAM_QUEUE') or 'telegram'
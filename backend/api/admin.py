@@ -11,4 +11,6 @@ admin.site.register(CurrencyBalance)
 admin.site.register(Operation)
 admin.site.register(Currency)
 admin.site.register(Rate)
+admin.site.register(RateRollup)
 admin.site.register(Watch)
+admin.site.register(Notification)
@@ -0,0 +1,18 @@
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+
+@dataclass
+class DeliveryStats:
+    """
+    Итоги доставки. results - признак успеха каждого сообщения в порядке отправки,
+    errors - тексты ошибок по номеру сообщения, если канал их сообщает.
+    """
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    results: List[bool] = field(default_factory=list)
+    errors: Dict[int, str] = field(default_factory=dict)
+
+    def __str__(self):
+        return f'отправлено {self.sent}, ошибок {self.failed}, повторов {self.retried}'
@@ -0,0 +1,111 @@
+import smtplib
+from typing import Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from .delivery import DeliveryStats
+
+
+class EmailSender:
+    """
+    Пакетная отправка писем через одно соединение почтового бэкенда.
+
+    Соединение открывается один раз на messages_per_connection писем и
+    переиспользуется всеми EmailMessage.send, поэтому SMTP-рукопожатие и
+    авторизация не повторяются для каждого получателя. Разорванное сервером
+    соединение открывается заново со следующего письма.
+
+    Атрибуты:
+        backend (str): Путь к бэкенду, по умолчанию EMAIL_BACKEND.
+        messages_per_connection (int): Писем на одно соединение до его переоткрытия.
+        backend_options (dict): Параметры бэкенда, например file_path или stream.
+    """
+
+    def __init__(self, backend: Optional[str] = None, messages_per_connection: Optional[int] = None,
+                 **backend_options):
+        self.backend = backend
+        self.messages_per_connection = messages_per_connection or settings.EMAIL_MESSAGES_PER_CONNECTION
+        self.backend_options = backend_options
+
+    def send_many(self, messages: Iterable[Tuple[str, str, str]]) -> DeliveryStats:
+        """
+        Отправляет письма, по одному получателю в каждом.
+
+        Аргументы:
+            messages (iterable): Тройки (адрес, тема, текст).
+
+        Возвращает:
+            DeliveryStats: Итоги доставки с текстами ошибок по номеру письма.
+        """
+        messages = list(messages)
+        stats = DeliveryStats()
+        connection = None
+        sent_on_connection = 0
+
+        try:
+            for index, (recipient, subject, text) in enumerate(messages):
+                if connection is not None and sent_on_connection >= self.messages_per_connection:
+                    self._close(connection)
+                    connection = None
+
+                if connection is None:
+                    try:
+                        connection = self._open()
+                        sent_on_connection = 0
+                    except Exception as e:
+                        # Сервер недоступен: остальные письма не ждут таймаута по очереди
+                        for failed in range(index, len(messages)):
+                            self._fail(stats, failed, e)
+
+                        break
+
+                try:
+                    EmailMessage(
+                        subject=subject,
+                        body=text,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        to=[recipient],
+                        connection=connection
+                    ).send()
+
+                    stats.results.append(True)
+                    stats.sent += 1
+                except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                    # Соединение потеряно, следующее письмо откроет новое. Остальные
+                    # SMTPException (отказ в получателе и т. п.) тоже наследуют OSError,
+                    # но соединение после них остаётся рабочим
+                    self._close(connection)
+                    connection = None
+                    self._fail(stats, index, e)
+                except Exception as e:
+                    self._fail(stats, index, e)
+
+                sent_on_connection += 1
+        finally:
+            self._close(connection)
+
+        return stats
+
+    def _open(self):
+        connection = get_connection(self.backend, fail_silently=False, **self.backend_options)
+        connection.open()
+
+        return connection
+
+    def _close(self, connection):
+        if connection is None:
+            return
+
+        try:
+            connection.close()
+        except Exception as e:
+            print(f"Ошибка при закрытии почтового соединения: {e}")
+
+    def _fail(self, stats: DeliveryStats, index: int, error: Exception):
+        stats.results.append(False)
+        stats.errors[index] = str(error) or error.__class__.__name__
+        stats.failed += 1
+
+
+mailer = EmailSender()
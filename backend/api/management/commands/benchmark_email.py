@@ -0,0 +1,66 @@
+import io
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.mailer import EmailSender
+
+
+class Command(BaseCommand):
+    help = ('Замер скорости отправки писем: отдельное соединение на каждое письмо против '
+            'переиспользуемого. По умолчанию письма пишутся во временный каталог '
+            '(filebased), --backend smtp отправляет через настроенный EMAIL_HOST.')
+
+    BACKENDS = {
+        'file': 'django.core.mail.backends.filebased.EmailBackend',
+        'console': 'django.core.mail.backends.console.EmailBackend',
+        'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+        'smtp': 'django.core.mail.backends.smtp.EmailBackend',
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=self.BACKENDS, default='file')
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--per-connection', type=int, default=100)
+        parser.add_argument('--recipient', default='benchmark@example.com')
+
+    def handle(self, *args, **options):
+        messages = [
+            (options['recipient'], f'Проверка {index}', f'Тестовое письмо {index}')
+            for index in range(options['messages'])
+        ]
+
+        for label, per_connection in (('по соединению на письмо', 1),
+                                      ('общее соединение', options['per_connection'])):
+            elapsed = self.measure(options['backend'], per_connection, messages)
+
+            self.stdout.write(f'{label}: {len(messages)} писем за {elapsed:.2f} с '
+                              f'({len(messages) / elapsed:.0f} в секунду)')
+
+    def measure(self, backend, per_connection, messages):
+        backend_options = {}
+        directory = None
+
+        if backend == 'file':
+            directory = tempfile.mkdtemp(prefix='benchmark-email-')
+            backend_options['file_path'] = directory
+        elif backend == 'console':
+            # Вывод письма тоже стоит времени, но в терминал он не нужен
+            backend_options['stream'] = io.StringIO()
+
+        sender = EmailSender(self.BACKENDS[backend], per_connection, **backend_options)
+
+        try:
+            started = time.monotonic()
+            stats = sender.send_many(messages)
+            elapsed = time.monotonic() - started
+        finally:
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        if stats.failed:
+            raise CommandError(f'Не отправлено {stats.failed} писем: {next(iter(stats.errors.values()))}')
+
+        return elapsed
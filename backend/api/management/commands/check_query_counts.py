@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.rates import latest_rates
+from api.seeding import seed_portfolio_lists
+from api.valuation import valuations
+from api.views import OperationViewSet, PortfolioViewSet, WatchViewSet
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Проверяет, что число запросов портфелей, операций и отслеживаний не зависит от числа строк '
+            'и портфелей при холодном кэше оценок и курсов. '
+            'Данные создаются во временной транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[5, 50, 500])
+
+    def handle(self, *args, **options):
+        counts = {}
+
+        try:
+            with transaction.atomic():
+                for size in options['sizes']:
+                    counts[size] = self.measure(size)
+
+                raise Rollback()
+        except Rollback:
+            pass
+
+        failures = []
+
+        for endpoint in counts[options['sizes'][0]]:
+            row = {size: counts[size][endpoint] for size in options['sizes']}
+
+            self.stdout.write(f'{endpoint}: ' + ', '.join(f'{size} строк - {count} запросов'
+                                                         for size, count in row.items()))
+
+            if len(set(row.values())) > 1:
+                failures.append(endpoint)
+
+        if failures:
+            raise CommandError(f'Число запросов зависит от числа строк: {", ".join(failures)}')
+
+        self.stdout.write(self.style.SUCCESS('Число запросов постоянно'))
+
+    def measure(self, size):
+        account, portfolios, currencies = seed_portfolio_lists(size, timezone.now().strftime('%H%M%S%f'))
+        portfolio = portfolios[0]
+        factory = APIRequestFactory()
+
+        endpoints = {
+            'portfolios/': (PortfolioViewSet.as_view({'get': 'list'}), {}),
+            'portfolios/<pk>/': (PortfolioViewSet.as_view({'get': 'retrieve'}), {'pk': portfolio.pk}),
+            'operations/': (OperationViewSet.as_view({'get': 'list'}), {}),
+            'watches/': (WatchViewSet.as_view({'get': 'list'}), {}),
+            'portfolios/<pk>/operations/': (PortfolioViewSet.as_view({'get': 'operations'}), {'pk': portfolio.pk}),
+            'portfolios/<pk>/watches/': (PortfolioViewSet.as_view({'get': 'watches'}), {'pk': portfolio.pk}),
+        }
+
+        counts = {}
+
+        try:
+            for endpoint, (view, kwargs) in endpoints.items():
+                request = factory.get(f'/api/v1/{endpoint}')
+                force_authenticate(request, user=account)
+
+                # Замер на холодном кэше: промахи оценок и курсов должны догружаться пакетно
+                valuations.invalidate(portfolio.id for portfolio in portfolios)
+                latest_rates.invalidate(currency.id for currency in currencies)
+
+                with CaptureQueriesContext(connection) as queries:
+                    response = view(request, **kwargs)
+
+                if response.status_code != 200:
+                    raise CommandError(f'{endpoint}: статус {response.status_code}')
+
+                counts[endpoint] = len(queries)
+        finally:
+            # Данные откатываются, а кэш общий
+            valuations.invalidate(portfolio.id for portfolio in portfolios)
+            latest_rates.invalidate(currency.id for currency in currencies)
+
+        return counts
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.models import Rate
+
+
+class Command(BaseCommand):
+    help = 'Удаляет дубли курсов (currency, timestamp), оставляя последнюю запись. Запускается перед migrate.'
+
+    def handle(self, *args, **options):
+        table = Rate._meta.db_table
+
+        if table not in connection.introspection.table_names():
+            self.stdout.write('Таблица курсов ещё не создана, удалять нечего')
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'''
+                DELETE FROM {table} AS duplicate
+                USING {table} AS kept
+                WHERE duplicate.currency_id = kept.currency_id
+                  AND duplicate.timestamp = kept.timestamp
+                  AND duplicate.id < kept.id
+            ''')
+
+            self.stdout.write(self.style.SUCCESS(f'Удалено дублей курсов: {cursor.rowcount}'))
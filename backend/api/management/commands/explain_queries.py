@@ -0,0 +1,159 @@
+import random
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Account, Currency, CurrencyBalance, Operation, Portfolio, PortfolioValue, Rate
+from api.revaluation import PortfolioRevaluationService
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN ANALYZE для основных запросов к курсам и портфелям. '
+            'С --seed запускается на сгенерированных данных и откатывает их после проверки.')
+
+    # Таблицы, последовательное сканирование которых на горячих запросах считается регрессией
+    HOT_TABLES = ('rate', 'portfolio_value', 'operation', 'currency_balance')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Сгенерировать данные во временной транзакции')
+        parser.add_argument('--portfolios', type=int, default=1000)
+        parser.add_argument('--currencies', type=int, default=20)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--snapshots', type=int, default=50, help='Снимков стоимости на портфель')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    self.seed(options)
+
+                self.explain_all()
+
+                if options['seed']:
+                    raise Rollback()
+        except Rollback:
+            self.stdout.write('Сгенерированные данные откачены')
+
+    def seed(self, options):
+        now = timezone.now()
+        suffix = timezone.now().strftime('%H%M%S%f')
+
+        currencies = Currency.objects.bulk_create([
+            Currency(name=f'Seed {index}', short_name=f'S{index}', description='')
+            for index in range(options['currencies'])
+        ])
+
+        Rate.objects.bulk_create([
+            Rate(currency=currency, cost=random.uniform(1, 100), timestamp=now - timedelta(days=day))
+            for currency in currencies
+            for day in range(options['days'])
+        ], batch_size=5000)
+
+        accounts = Account.objects.bulk_create([
+            Account(username=f'seed-{suffix}-{index}', email=f'seed-{suffix}-{index}@example.com')
+            for index in range(options['portfolios'])
+        ])
+
+        portfolios = Portfolio.objects.bulk_create([
+            Portfolio(account=account, balance=100000, notify_threshold=random.choice([None, 5]))
+            for account in accounts
+        ])
+
+        CurrencyBalance.objects.bulk_create([
+            CurrencyBalance(portfolio=portfolio, currency=currency, amount=random.uniform(1, 10))
+            for portfolio in portfolios
+            for currency in random.sample(currencies, min(5, len(currencies)))
+        ], batch_size=5000)
+
+        Operation.objects.bulk_create([
+            Operation(portfolio=portfolio, currency=random.choice(currencies), operation_type='buy',
+                      amount=1, price=random.uniform(1, 100))
+            for portfolio in portfolios
+            for _ in range(10)
+        ], batch_size=5000)
+
+        values = PortfolioValue.objects.bulk_create([
+            PortfolioValue(portfolio=portfolio, value=random.uniform(90000, 110000))
+            for portfolio in portfolios
+            for _ in range(options['snapshots'])
+        ], batch_size=5000)
+
+        # timestamp заполняется auto_now_add, поэтому история растягивается отдельным обновлением
+        for index, value in enumerate(values):
+            value.timestamp = now - timedelta(minutes=5 * (index % options['snapshots']))
+
+        PortfolioValue.objects.bulk_update(values, ['timestamp'], batch_size=5000)
+
+        with connection.cursor() as cursor:
+            for table in self.HOT_TABLES + ('portfolio', 'currency'):
+                cursor.execute(f'ANALYZE {table}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Сгенерировано: {len(portfolios)} портфелей, {len(currencies)} валют, '
+            f'{len(currencies) * options["days"]} курсов, {len(values)} снимков'
+        ))
+
+    def queries(self):
+        currency = Currency.objects.order_by('id').first()
+        portfolio = Portfolio.objects.order_by('id').first()
+        portfolio_ids = list(Portfolio.objects.order_by('id').values_list('id', flat=True)[:1000])
+
+        yield 'Последние курсы всех валют (DISTINCT ON)', (
+            Rate.objects.order_by('currency_id', '-timestamp').distinct('currency_id')
+            .values_list('currency_id', 'cost', 'timestamp')
+        )
+
+        if currency is not None:
+            yield 'Последний курс валюты', Rate.objects.filter(currency=currency).order_by('-timestamp')[:1]
+            yield 'История курсов валюты', Rate.objects.filter(currency=currency).order_by('-timestamp')[:100]
+
+        if portfolio is not None:
+            yield 'Последний снимок стоимости портфеля', (
+                PortfolioValue.objects.filter(portfolio=portfolio).order_by('-timestamp')[:1]
+            )
+            yield 'Операции пользователя', (
+                Operation.objects.filter(portfolio__account_id=portfolio.account_id).order_by('-timestamp')
+            )
+            yield 'Остатки валют портфеля', CurrencyBalance.objects.filter(portfolio=portfolio)
+
+        if portfolio_ids:
+            yield 'Предыдущие снимки пакета портфелей (DISTINCT ON)', (
+                PortfolioValue.objects.filter(portfolio_id__in=portfolio_ids)
+                .order_by('portfolio_id', '-timestamp').distinct('portfolio_id')
+                .values_list('portfolio_id', 'value')
+            )
+
+            service = PortfolioRevaluationService()
+            since = timezone.now() - timedelta(minutes=5)
+
+            yield ('Сработавшие пороги уведомлений пакета портфелей',
+                   service.breaching_portfolios(portfolio_ids, since))
+
+    def explain_all(self):
+        regressions = []
+
+        for title, queryset in self.queries():
+            plan = queryset.explain(analyze=True, buffers=True)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(plan)
+            self.stdout.write('')
+
+            for table in self.HOT_TABLES:
+                if re.search(rf'Seq Scan on {table}(_p\d+|_default)?\b', plan):
+                    regressions.append(f'{title}: Seq Scan on {table}')
+
+        if regressions:
+            self.stdout.write(self.style.WARNING('Последовательное сканирование горячих таблиц:'))
+
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(f'  {regression}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Все запросы используют индексы'))
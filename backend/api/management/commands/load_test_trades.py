@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from api.models import Account, Currency, CurrencyBalance, Operation, Portfolio, Rate
+from api.rates import latest_rates
+from api.trading import TradeError, trades
+from api.valuation import valuations
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочная проверка сделок: параллельные покупки и продажи двух валют в одном портфеле, '
+            'пока курс одной из них меняется. Проверяет, что баланс и остатки сходятся с успешными '
+            'операциями, а оценка в кэше - с оценкой из базы. '
+            'Данные создаются в базе и удаляются после проверки.')
+
+    PRICE = 10.0
+    # Пауза между новыми курсами второй валюты во время сделок
+    TICK_INTERVAL = 0.01
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--affordable', type=int, default=1000,
+                            help='Сколько покупок по одной единице первой валюты покрывает начальный баланс')
+
+    def handle(self, *args, **options):
+        account, portfolio, currencies = self.seed(options['affordable'])
+        stop = threading.Event()
+
+        try:
+            ticker = threading.Thread(target=self.tick, args=(currencies[1], stop))
+            ticker.start()
+            started = time.monotonic()
+
+            try:
+                with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                    results = list(executor.map(
+                        lambda order: self.trade(portfolio.id, *order),
+                        [(random.choice(['buy', 'buy', 'sell']), random.choice(currencies))
+                         for _ in range(options['requests'])]
+                    ))
+            finally:
+                stop.set()
+                ticker.join()
+
+            elapsed = time.monotonic() - started
+
+            self.verify_portfolio(portfolio, currencies, options['affordable'], results)
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{len(results)} сделок за {elapsed:.2f} с ({len(results) / elapsed:.0f} в секунду), '
+                f'успешных покупок: {results.count("buy")}, продаж: {results.count("sell")}, '
+                f'отклонено: {results.count(None)}. Потерянных обновлений нет, оценка в кэше совпадает с базой'
+            ))
+        finally:
+            account.delete()
+            valuations.invalidate([portfolio.id])
+            latest_rates.invalidate([currency.id for currency in currencies])
+
+            for currency in currencies:
+                currency.delete()
+
+    def seed(self, affordable):
+        suffix = timezone.now().strftime('%H%M%S%f')
+
+        account = Account.objects.create(username=f'load-{suffix}', email=f'load-{suffix}@example.com')
+        portfolio = Portfolio.objects.create(account=account, balance=affordable * self.PRICE)
+        currencies = [
+            Currency.objects.create(name=f'Load {suffix} {index}', short_name=f'L{index}{suffix}', description='')
+            for index in range(2)
+        ]
+
+        Rate.objects.bulk_create([
+            Rate(currency=currency, cost=self.PRICE, timestamp=timezone.now()) for currency in currencies
+        ])
+        latest_rates.refresh([currency.id for currency in currencies])
+
+        return account, portfolio, currencies
+
+    def trade(self, portfolio_id, side, currency):
+        try:
+            getattr(trades, side)(portfolio_id, currency, 1)
+
+            return side
+        except TradeError:
+            return None
+        finally:
+            # Каждый поток работает со своим соединением
+            connection.close()
+
+    def tick(self, currency, stop):
+        """
+        Публикует новые курсы валюты так же, как загрузка курсов: запись, обновление кэша, сброс оценок.
+        """
+        try:
+            while not stop.is_set():
+                Rate.objects.create(currency=currency, cost=round(random.uniform(5, 15), 4), timestamp=timezone.now())
+                latest_rates.refresh([currency.id])
+                valuations.apply_rates([currency.id])
+                time.sleep(self.TICK_INTERVAL)
+        finally:
+            connection.close()
+
+    def verify_portfolio(self, portfolio, currencies, affordable, results):
+        operations = Operation.objects.filter(portfolio=portfolio)
+        bought = operations.filter(operation_type='buy').count()
+        sold = operations.filter(operation_type='sell').count()
+
+        if (bought, sold) != (results.count('buy'), results.count('sell')):
+            raise CommandError(f'Операций в базе {bought}/{sold}, успешных ответов '
+                               f'{results.count("buy")}/{results.count("sell")}')
+
+        spent = operations.filter(operation_type='buy').aggregate(total=Sum(F('amount') * F('price')))['total'] or 0
+        earned = operations.filter(operation_type='sell').aggregate(total=Sum(F('amount') * F('price')))['total'] or 0
+
+        balance = Portfolio.objects.values_list('balance', flat=True).get(id=portfolio.id)
+        expected_balance = affordable * self.PRICE - spent + earned
+
+        if abs(balance - expected_balance) > 1e-6:
+            raise CommandError(f'Баланс {balance}, ожидается {expected_balance}')
+
+        for currency in currencies:
+            holding = CurrencyBalance.objects.filter(portfolio=portfolio, currency=currency).values_list(
+                'amount', flat=True
+            ).first() or 0
+            expected_holding = (operations.filter(currency=currency, operation_type='buy').count()
+                                - operations.filter(currency=currency, operation_type='sell').count())
+
+            if abs(holding - expected_holding) > 1e-6:
+                raise CommandError(f'Остаток {currency.short_name} {holding}, ожидается {expected_holding}')
+
+            if holding < 0:
+                raise CommandError(f'Отрицательный остаток {currency.short_name}')
+
+        if balance < 0:
+            raise CommandError('Отрицательный баланс')
+
+        cached = valuations.get(portfolio.id)
+        actual = valuations.build_many({portfolio.id: balance})[portfolio.id]
+
+        if abs(cached.total - actual.total) > 1e-6:
+            raise CommandError(f'Оценка портфеля в кэше {cached.total}, по базе {actual.total}')
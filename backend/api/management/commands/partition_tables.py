@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.partitions import PartitionManager
+
+
+class Command(BaseCommand):
+    help = ('Секционирует таблицы курсов и снимков стоимости по месяцам, создаёт будущие секции '
+            'и удаляет секции старше срока хранения. Запускается после migrate.')
+
+    def handle(self, *args, **options):
+        actions = PartitionManager().maintain()
+
+        for action in actions:
+            self.stdout.write(action)
+
+        self.stdout.write(self.style.SUCCESS(f'Секционирование актуально, изменений: {len(actions)}'))
@@ -1,5 +1,19 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+
+
+def count_subquery(queryset, field: str):
+    """
+    Количество строк queryset, сгруппированных по field, в виде подзапроса.
+
+    В отличие от нескольких Count по связям в одном запросе не перемножает строки соединений.
+    """
+    counts = queryset.order_by().values(field).annotate(count=Count('*')).values('count')
+
+    return Coalesce(Subquery(counts), 0)
 
 
 class Account(AbstractUser):
@@ -31,13 +45,41 @@ class TelegramVerificationLink(models.Model):
         verbose_name_plural = 'Telegram Verification Links'
 
 
+class PortfolioQuerySet(models.QuerySet):
+    def with_summary(self):
+        """
+        Добавляет к портфелям счётчики операций, отслеживаемых валют и остатков.
+        """
+        return self.select_related('account').annotate(
+            operations_count=count_subquery(
+                Operation.objects.filter(portfolio_id=OuterRef('pk')), 'portfolio_id'
+            ),
+            watches_count=count_subquery(
+                Watch.objects.filter(portfolio_id=OuterRef('pk')), 'portfolio_id'
+            ),
+            currencies_count=count_subquery(
+                CurrencyBalance.objects.filter(portfolio_id=OuterRef('pk')), 'portfolio_id'
+            ),
+        )
+
+
+class PortfolioItemQuerySet(models.QuerySet):
+    def with_portfolio_summary(self):
+        """
+        Загружает валюту и портфель со счётчиками, чтобы список операций
+        или отслеживаний выводился постоянным числом запросов.
+        """
+        return self.select_related('currency').prefetch_related(
+            Prefetch('portfolio', queryset=Portfolio.objects.with_summary())
+        )
+
+
 class Portfolio(models.Model):
     account = models.ForeignKey('Account', on_delete=models.CASCADE)
     balance = models.FloatField()
-    currencies = models.ManyToManyField('CurrencyBalance', related_name='portfolios', blank=True)
-    operations = models.ManyToManyField('Operation', related_name='portfolios', blank=True)
     notify_threshold = models.FloatField(null=True, blank=True)
-    watches = models.ManyToManyField('Watch', related_name='portfolios', blank=True)
+
+    objects = PortfolioQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.account.username} {self.balance}'
@@ -62,6 +104,9 @@ class CurrencyBalance(models.Model):
         db_table_comment = 'Currency Balance In Portfolio'
         verbose_name = 'Currency Balance'
         verbose_name_plural = 'Currency Balances'
+        indexes = [
+            models.Index(fields=['portfolio', 'currency'], name='currency_balance_portfolio_idx')
+        ]
 
 
 class Operation(models.Model):
@@ -74,6 +119,8 @@ class Operation(models.Model):
     price = models.FloatField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = PortfolioItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.operation_type} {self.currency} {self.amount} * {self.price} -> {self.amount * self.price}"
 
@@ -82,6 +129,9 @@ class Operation(models.Model):
         db_table_comment = 'Operations In Portfolio'
         verbose_name = 'Operation'
         verbose_name_plural = 'Operations'
+        indexes = [
+            models.Index(fields=['portfolio', '-timestamp'], name='operation_portfolio_ts_idx')
+        ]
 
 
 class PortfolioValue(models.Model):
@@ -98,6 +148,9 @@ class PortfolioValue(models.Model):
         verbose_name = 'Portfolio Value'
         verbose_name_plural = 'Portfolio Values'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['portfolio', '-timestamp'], name='portfolio_value_ts_idx')
+        ]
 
 
 class Currency(models.Model):
@@ -129,6 +182,40 @@ class Rate(models.Model):
         verbose_name = 'Rate'
         verbose_name_plural = 'Rates'
         ordering = ['-timestamp']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'timestamp'], name='rate_currency_timestamp_uniq')
+        ]
+        indexes = [
+            # DISTINCT ON (currency_id) ... ORDER BY currency_id, timestamp DESC
+            # не может использовать обратный обход уникального индекса
+            models.Index(fields=['currency', '-timestamp'], name='rate_currency_ts_desc_idx')
+        ]
+
+
+class RateRollup(models.Model):
+    Resolution = models.TextChoices('Resolution', 'HOUR DAY WEEK')
+
+    currency = models.ForeignKey('Currency', on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=16, choices=Resolution)
+    bucket = models.DateTimeField()
+    open = models.FloatField()
+    high = models.FloatField()
+    low = models.FloatField()
+    close = models.FloatField()
+    count = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'{self.currency} {self.resolution} {self.bucket} {self.close}'
+
+    class Meta:
+        db_table = 'rate_rollup'
+        db_table_comment = 'OHLC Rollups Of Rates'
+        verbose_name = 'Rate Rollup'
+        verbose_name_plural = 'Rate Rollups'
+        ordering = ['-bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'resolution', 'bucket'], name='rate_rollup_bucket_uniq')
+        ]
 
 
 class Watch(models.Model):
@@ -136,6 +223,8 @@ class Watch(models.Model):
     currency = models.ForeignKey('Currency', on_delete=models.CASCADE)
     notify_time = models.TimeField()
 
+    objects = PortfolioItemQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.portfolio} {self.currency} {self.notify_time}'
 
@@ -144,3 +233,36 @@ class Watch(models.Model):
         db_table_comment = 'Watches Of Currencies'
         verbose_name = 'Watch'
         verbose_name_plural = 'Watches'
+        indexes = [
+            models.Index(fields=['notify_time'], name='watch_notify_time_idx')
+        ]
+
+
+class Notification(models.Model):
+    Channel = models.TextChoices('Channel', 'TELEGRAM EMAIL')
+    Status = models.TextChoices('Status', 'PENDING SENT FAILED')
+
+    channel = models.CharField(max_length=16, choices=Channel)
+    recipient = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255, blank=True)
+    message = models.TextField()
+    status = models.CharField(max_length=16, choices=Status, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.channel} {self.recipient} {self.status}'
+
+    class Meta:
+        db_table = 'notification'
+        db_table_comment = 'Notification Outbox'
+        verbose_name = 'Notification'
+        verbose_name_plural = 'Notifications'
+        indexes = [
+            # Очередь воркеров: только ожидающие отправки сообщения
+            models.Index(fields=['channel', 'available_at', 'id'], name='notification_pending_idx',
+                         condition=models.Q(status='PENDING'))
+        ]
@@ -0,0 +1,165 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Currency, Watch
+from .rates import LatestRate, latest_rates
+
+
+def render_rate_message(currency: Currency, latest_rate: LatestRate) -> str:
+    """
+    Текст уведомления о курсе валюты.
+    """
+    return (
+        f"<b>Обновление курса валют</b>\n\n"
+        f"💱 {currency.name} ({currency.short_name})\n"
+        f"📈 Курс: {latest_rate.cost}\n"
+        f"⏰ Время: {latest_rate.timestamp}"
+    )
+
+
+@dataclass
+class WatchNotificationBatch:
+    """
+    Пакет получателей одного уведомления о курсе.
+
+    Атрибуты:
+        subject (str): Тема письма.
+        message (str): Текст уведомления, общий для всех получателей валюты.
+        chat_ids (list): Идентификаторы чатов Telegram.
+        emails (list): Адреса электронной почты.
+    """
+    subject: str
+    message: str
+    chat_ids: List[int] = field(default_factory=list)
+    emails: List[str] = field(default_factory=list)
+
+
+class WatchNotificationDispatcher:
+    """
+    Рассылка уведомлений об отслеживаемых валютах одной периодической задачей.
+
+    Раз в минуту выбираются отслеживания, время уведомления которых попало в прошедшие
+    с прошлого запуска минуты (индекс по notify_time). Окно забирается атомарно до
+    рассылки, поэтому каждая минута рассылается один раз. Отслеживания группируются
+    по валюте, текст для каждой валюты формируется один раз, а получатели делятся
+    на пакеты.
+    Время уведомления задаётся в часовом поясе планировщика Celery.
+    """
+
+    LAST_MINUTE_KEY = 'watch-dispatch:last-minute'
+    LOCK_KEY = 'watch-dispatch:lock'
+    LOCK_TIMEOUT = 30
+    CATCH_UP = timedelta(minutes=15)
+    BATCH_SIZE = 500
+
+    def __init__(self, batch_size: Optional[int] = None):
+        self.batch_size = batch_size or self.BATCH_SIZE
+
+    @property
+    def time_zone(self) -> ZoneInfo:
+        return ZoneInfo(settings.CELERY_TIMEZONE or settings.TIME_ZONE or 'UTC')
+
+    def claim(self, now: Optional[datetime] = None) -> Optional[Tuple[datetime, datetime]]:
+        """
+        Атомарно забирает полуинтервал минут [start, end), которые нужно обработать.
+
+        Окно читается и сдвигается под блокировкой в кэше до формирования уведомлений,
+        поэтому параллельные или повторные запуски не рассылают одни и те же минуты.
+        Пропущенные минуты (например, после простоя планировщика) догоняются,
+        но не дальше CATCH_UP назад.
+
+        Возвращает:
+            tuple | None: Границы окна или None, если окно уже забрано другим запуском.
+        """
+        if not cache.add(self.LOCK_KEY, True, timeout=self.LOCK_TIMEOUT):
+            return None
+
+        try:
+            current = (now or timezone.now()).astimezone(self.time_zone).replace(second=0, microsecond=0)
+            end = current + timedelta(minutes=1)
+            last = cache.get(self.LAST_MINUTE_KEY)
+
+            if last is not None and last >= end:
+                return None
+
+            start = current if last is None or end - last > self.CATCH_UP else last
+            cache.set(self.LAST_MINUTE_KEY, end, timeout=int(self.CATCH_UP.total_seconds()) * 2)
+
+            return start, end
+        finally:
+            cache.delete(self.LOCK_KEY)
+
+    def due_watches(self, start: datetime, end: datetime) -> List[Tuple[int, Optional[int], Optional[str]]]:
+        """
+        Отслеживания со временем уведомления в [start, end) и контакты их владельцев.
+
+        Возвращает:
+            list: Кортежи (currency_id, telegram_chat_id, email).
+        """
+        if start.date() == end.date() or end.time() == datetime.min.time():
+            condition = Q(notify_time__gte=start.time())
+
+            if end.time() != datetime.min.time():
+                condition &= Q(notify_time__lt=end.time())
+        else:
+            # Окно переходит через полночь
+            condition = Q(notify_time__gte=start.time()) | Q(notify_time__lt=end.time())
+
+        return list(
+            Watch.objects
+            .filter(condition)
+            .values_list('currency_id', 'portfolio__account__telegram_chat_id', 'portfolio__account__email')
+        )
+
+    def dispatch(self, now: Optional[datetime] = None) -> Iterator[WatchNotificationBatch]:
+        """
+        Формирует пакеты уведомлений для наступивших отслеживаний.
+
+        Возвращает:
+            iterator: Пакеты WatchNotificationBatch размером не более batch_size получателей.
+        """
+        window = self.claim(now)
+
+        if window is None:
+            return
+
+        start, end = window
+        recipients = defaultdict(lambda: (set(), set()))
+
+        for currency_id, chat_id, email in self.due_watches(start, end):
+            chat_ids, emails = recipients[currency_id]
+
+            if chat_id:
+                chat_ids.add(chat_id)
+            if email:
+                emails.add(email)
+
+        rates = latest_rates.get_many(recipients.keys())
+        currencies = Currency.objects.in_bulk(rates.keys())
+
+        for currency_id, (chat_ids, emails) in recipients.items():
+            if currency_id not in rates:
+                continue
+
+            currency = currencies[currency_id]
+            message = render_rate_message(currency, rates[currency_id])
+            chat_ids, emails = sorted(chat_ids), sorted(emails)
+
+            for offset in range(0, max(len(chat_ids), len(emails)), self.batch_size):
+                yield WatchNotificationBatch(
+                    subject=f'Курс {currency.short_name}',
+                    message=message,
+                    chat_ids=chat_ids[offset:offset + self.batch_size],
+                    emails=emails[offset:offset + self.batch_size]
+                )
+
+
+watch_dispatcher = WatchNotificationDispatcher()
@@ -0,0 +1,199 @@
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterable, List, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from .mailer import mailer
+from .models import Notification
+from .telegram import telegram
+
+
+@dataclass
+class OutboxStats:
+    batches: int = 0
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+
+    def __str__(self):
+        return (f'{self.batches} пакетов: отправлено {self.sent}, '
+                f'отложено {self.retried}, не доставлено {self.failed}')
+
+
+class NotificationOutbox:
+    """
+    Транзакционная очередь уведомлений.
+
+    Задачи-источники только вставляют строки Notification пакетно, а доставкой
+    занимаются воркеры deliver_notifications. Воркер захватывает пакет через
+    SELECT ... FOR UPDATE SKIP LOCKED, арендуя его на LEASE, и фиксирует захват
+    до доставки, поэтому несколько воркеров разбирают очередь параллельно, не
+    держа блокировок во время сетевых запросов. Неудачные сообщения откладываются
+    с растущей задержкой и помечаются FAILED после MAX_ATTEMPTS попыток.
+    """
+
+    BATCH_SIZE = 100
+    MAX_ATTEMPTS = 5
+    RETRY_BACKOFF = timedelta(minutes=1)
+    # Время, на которое захваченный пакет скрыт от других воркеров
+    LEASE = timedelta(minutes=5)
+    # Сколько секунд воркер разбирает очередь, прежде чем уступить планировщику
+    TIME_BUDGET = 50
+
+    def __init__(self, batch_size: Optional[int] = None):
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.channels = {
+            Notification.Channel.TELEGRAM: self.deliver_telegram,
+            Notification.Channel.EMAIL: self.deliver_email,
+        }
+
+    def build(self, subject: str, message: str, chat_ids: Iterable[int] = (),
+              emails: Iterable[str] = ()) -> List[Notification]:
+        """
+        Готовит уведомления одного текста для получателей в Telegram и по почте.
+        """
+        return [
+            Notification(channel=Notification.Channel.TELEGRAM, recipient=str(chat_id),
+                         subject=subject, message=message)
+            for chat_id in chat_ids
+        ] + [
+            Notification(channel=Notification.Channel.EMAIL, recipient=email,
+                         subject=subject, message=message)
+            for email in emails
+        ]
+
+    def enqueue(self, notifications: List[Notification]) -> int:
+        """
+        Вставляет уведомления одним пакетом и после фиксации будит воркеры их каналов.
+
+        Возвращает:
+            int: Количество поставленных в очередь уведомлений.
+        """
+        if not notifications:
+            return 0
+
+        from .tasks import deliver_notifications
+
+        Notification.objects.bulk_create(notifications, batch_size=1000)
+
+        for channel in {notification.channel for notification in notifications}:
+            transaction.on_commit(lambda channel=channel: deliver_notifications.delay(channel))
+
+        return len(notifications)
+
+    def process(self, channel: Optional[str] = None) -> OutboxStats:
+        """
+        Разбирает очередь канала (или всех каналов) пакетами, пока она не опустеет
+        или не истечёт TIME_BUDGET.
+        """
+        stats = OutboxStats()
+        deadline = time.monotonic() + self.TIME_BUDGET
+
+        for name in [channel] if channel else list(self.channels):
+            while time.monotonic() < deadline and self.process_batch(name, stats):
+                pass
+
+        return stats
+
+    def process_batch(self, channel: str, stats: OutboxStats) -> bool:
+        """
+        Забирает и доставляет один пакет.
+
+        Блокировки держатся только на время двух коротких транзакций: захвата пакета
+        и записи результатов. Сетевая доставка выполняется между ними вне транзакции.
+
+        Возвращает:
+            bool: False, если доступных сообщений канала не осталось.
+        """
+        batch = self.claim(channel)
+
+        if not batch:
+            return False
+
+        try:
+            errors = self.channels[channel](batch)
+        except Exception as e:
+            print(f"Ошибка при доставке уведомлений {channel}: {e}")
+            errors = [str(e) or e.__class__.__name__] * len(batch)
+
+        self.record(batch, errors, stats)
+        stats.batches += 1
+
+        return True
+
+    def claim(self, channel: str) -> List[Notification]:
+        """
+        Захватывает пакет: сдвигает available_at на LEASE вперёд и сразу засчитывает попытку.
+
+        Пока аренда не истекла, сообщения не видны другим воркерам. Если воркер упал
+        во время доставки, сообщения снова станут доступны по истечении аренды, а
+        засчитанные попытки не дадут сообщению, роняющему воркер, повторяться вечно.
+        """
+        now = timezone.now()
+
+        with transaction.atomic():
+            batch = list(
+                Notification.objects
+                .select_for_update(skip_locked=True)
+                .filter(channel=channel, status=Notification.Status.PENDING, available_at__lte=now)
+                .order_by('available_at', 'id')[:self.batch_size]
+            )
+
+            if not batch:
+                return batch
+
+            for notification in batch:
+                notification.attempts += 1
+                notification.available_at = now + self.LEASE
+
+            Notification.objects.bulk_update(batch, ['attempts', 'available_at'])
+
+        return batch
+
+    def record(self, batch: List[Notification], errors: List[Optional[str]], stats: OutboxStats):
+        """
+        Записывает результаты доставки пакета одним обновлением.
+        """
+        now = timezone.now()
+
+        for notification, error in zip(batch, errors):
+            if error is None:
+                notification.status = Notification.Status.SENT
+                notification.sent_at = now
+                stats.sent += 1
+            elif notification.attempts >= self.MAX_ATTEMPTS:
+                notification.status = Notification.Status.FAILED
+                notification.last_error = error
+                stats.failed += 1
+            else:
+                notification.last_error = error
+                notification.available_at = now + self.RETRY_BACKOFF * 2 ** (notification.attempts - 1)
+                stats.retried += 1
+
+        with transaction.atomic():
+            Notification.objects.bulk_update(batch, ['status', 'last_error', 'available_at', 'sent_at'])
+
+    def deliver_telegram(self, batch: List[Notification]) -> List[Optional[str]]:
+        """
+        Возвращает:
+            list: Для каждого уведомления None при успехе или текст ошибки.
+        """
+        delivery = telegram.send_many((int(notification.recipient), notification.message) for notification in batch)
+
+        return [None if sent else 'Telegram не принял сообщение' for sent in delivery.results]
+
+    def deliver_email(self, batch: List[Notification]) -> List[Optional[str]]:
+        delivery = mailer.send_many(
+            (notification.recipient, notification.subject, notification.message) for notification in batch
+        )
+
+        return [
+            None if sent else delivery.errors.get(index, 'Почтовый сервер не принял письмо')
+            for index, sent in enumerate(delivery.results)
+        ]
+
+
+outbox = NotificationOutbox()
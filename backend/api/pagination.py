@@ -0,0 +1,26 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class RateCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация истории курсов по timestamp.
+
+    Позицию курсора DRF строит только по первому полю сортировки: страница
+    выбирается условием timestamp < позиции по индексу, а не OFFSET, поэтому
+    стоимость запроса не растёт с длиной истории. -id лишь упорядочивает строки
+    с одинаковым временем; такие строки на границе страницы пропускаются
+    смещением внутри курсора. В пределах одной валюты время уникально
+    (currency, timestamp), так что смещение возникает только в общем списке курсов.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = settings.RATES_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.RATES_MAX_PAGE_SIZE
+
+
+class RateRollupCursorPagination(RateCursorPagination):
+    """
+    Курсорная пагинация агрегатов курсов. Корзина уникальна в пределах валюты и разрешения.
+    """
+    ordering = ('-bucket',)
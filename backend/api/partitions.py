@@ -0,0 +1,277 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone as django_timezone
+
+from .models import PortfolioValue, Rate
+
+
+@dataclass
+class PartitionedTable:
+    """
+    Таблица временного ряда, секционированная по месяцам.
+
+    Атрибуты:
+        table (str): Имя таблицы.
+        column (str): Столбец ключа секционирования.
+        retention_months (int | None): Сколько месяцев хранить. None - хранить всё.
+    """
+    table: str
+    column: str
+    retention_months: Optional[int] = None
+
+
+class PartitionManager:
+    """
+    Секционирование таблиц Rate и PortfolioValue по месяцам (PARTITION BY RANGE).
+
+    Django создаёт таблицы обычными, поэтому convert один раз переносит данные
+    в секционированную таблицу с теми же именами ограничений и индексов.
+    Первичный ключ расширяется ключом секционирования до (id, timestamp),
+    а id получает значения из последовательности {table}_id_seq вместо identity.
+    ensure_partitions заранее создаёт будущие секции, split_default переносит
+    строки, попавшие в секцию по умолчанию (например, загруженные задним числом),
+    в месячные секции, а drop_expired отсоединяет и удаляет секции старше срока
+    хранения, в том числе выделенные из секции по умолчанию.
+    """
+
+    def __init__(self, months_ahead: Optional[int] = None, detach_only: Optional[bool] = None):
+        self.months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+        self.detach_only = settings.PARTITION_DETACH_ONLY if detach_only is None else detach_only
+        self.tables = [
+            PartitionedTable(Rate._meta.db_table, 'timestamp', settings.RATE_RETENTION_MONTHS),
+            PartitionedTable(PortfolioValue._meta.db_table, 'timestamp', settings.PORTFOLIO_VALUE_RETENTION_MONTHS),
+        ]
+
+    def maintain(self) -> List[str]:
+        """
+        Секционирует таблицы при необходимости, создаёт будущие секции и удаляет устаревшие.
+
+        Возвращает:
+            list: Описание выполненных действий.
+        """
+        actions = []
+
+        for table in self.tables:
+            if table.table not in connection.introspection.table_names():
+                continue
+
+            if not self.is_partitioned(table):
+                self.convert(table)
+                actions.append(f'{table.table}: преобразована в секционированную')
+
+            # Строки из секции по умолчанию переносятся первыми: пока они там, секцию их месяца не создать
+            actions.extend(f'{table.table}: секция {name} выделена из секции по умолчанию'
+                           for name in self.split_default(table))
+            actions.extend(f'{table.table}: создана секция {name}' for name in self.ensure_partitions(table))
+            actions.extend(f'{table.table}: удалена секция {name}' for name in self.drop_expired(table))
+
+        return actions
+
+    def is_partitioned(self, table: PartitionedTable) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)',
+                [table.table]
+            )
+
+            return cursor.fetchone() is not None
+
+    def convert(self, table: PartitionedTable):
+        """
+        Переносит обычную таблицу в секционированную в одной транзакции.
+        """
+        name = connection.ops.quote_name(table.table)
+        legacy = connection.ops.quote_name(f'{table.table}_legacy')
+        column = connection.ops.quote_name(table.column)
+        sequence = connection.ops.quote_name(f'{table.table}_id_seq')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT conname, contype, pg_get_constraintdef(oid)
+                FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+            ''', [table.table])
+            constraints = cursor.fetchall()
+
+            cursor.execute('''
+                SELECT pg_get_indexdef(index.indexrelid)
+                FROM pg_index AS index
+                WHERE index.indrelid = %s::regclass
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = index.indexrelid)
+            ''', [table.table])
+            indexes = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute('SELECT obj_description(%s::regclass, %s)', [table.table, 'pg_class'])
+            comment = cursor.fetchone()[0]
+
+            cursor.execute(f'SELECT min({column}) FROM {name}')
+            oldest = cursor.fetchone()[0]
+
+            cursor.execute(f'ALTER TABLE {name} RENAME TO {legacy}')
+            # Столбец identity на секционированных таблицах полноценно поддерживается только с PostgreSQL 17,
+            # поэтому id объявляется обычным bigint со значением по умолчанию из отдельной последовательности
+            cursor.execute(f'''
+                CREATE TABLE {name} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING COMMENTS)
+                PARTITION BY RANGE ({column})
+            ''')
+            cursor.execute(f'CREATE TABLE {connection.ops.quote_name(table.table + "_default")} '
+                           f'PARTITION OF {name} DEFAULT')
+
+            self.ensure_partitions(table, since=oldest)
+
+            cursor.execute(f'INSERT INTO {name} SELECT * FROM {legacy}')
+            # Вместе со старой таблицей удаляется и её последовательность identity
+            cursor.execute(f'DROP TABLE {legacy}')
+            cursor.execute(f'CREATE SEQUENCE {sequence} AS bigint OWNED BY {name}.id')
+            cursor.execute(f"ALTER TABLE {name} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+            cursor.execute(
+                f"SELECT setval(%s, coalesce((SELECT max(id) FROM {name}), 0) + 1, false)",
+                [f'{table.table}_id_seq']
+            )
+
+            for constraint_name, constraint_type, definition in constraints:
+                if constraint_type == 'p':
+                    definition = f'PRIMARY KEY (id, {column})'
+
+                cursor.execute(f'ALTER TABLE {name} ADD CONSTRAINT '
+                               f'{connection.ops.quote_name(constraint_name)} {definition}')
+
+            for definition in indexes:
+                cursor.execute(definition)
+
+            if comment:
+                cursor.execute(f'COMMENT ON TABLE {name} IS %s', [comment])
+
+    def ensure_partitions(self, table: PartitionedTable, since: Optional[datetime] = None) -> List[str]:
+        """
+        Создаёт месячные секции от since (по умолчанию от текущего месяца) на months_ahead месяцев вперёд.
+
+        Возвращает:
+            list: Имена созданных секций.
+        """
+        now = django_timezone.now()
+        month = self._month_start(since or now)
+        last = self._add_months(self._month_start(now), self.months_ahead)
+        existing = set(self.partitions(table))
+        created = []
+
+        with connection.cursor() as cursor:
+            while month <= last:
+                partition = self.partition_name(table, month)
+
+                if partition not in existing:
+                    cursor.execute(
+                        f'CREATE TABLE {connection.ops.quote_name(partition)} '
+                        f'PARTITION OF {connection.ops.quote_name(table.table)} '
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{self._add_months(month, 1).isoformat()}')"
+                    )
+                    created.append(partition)
+
+                month = self._add_months(month, 1)
+
+        return created
+
+    def split_default(self, table: PartitionedTable) -> List[str]:
+        """
+        Переносит строки секции по умолчанию в месячные секции их месяцев.
+
+        Для каждого месяца секция создаётся отдельной таблицей, заполняется строками
+        этого месяца и присоединяется после их удаления из секции по умолчанию,
+        поэтому такие строки затем удаляются вместе со своей секцией по сроку хранения.
+
+        Возвращает:
+            list: Имена созданных секций.
+        """
+        name = connection.ops.quote_name(table.table)
+        default = connection.ops.quote_name(f'{table.table}_default')
+        column = connection.ops.quote_name(table.column)
+        created = []
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT date_trunc('month', {column}, 'UTC') FROM {default}")
+            months = sorted(self._month_start(row[0]) for row in cursor.fetchall())
+
+            for month in months:
+                partition = connection.ops.quote_name(self.partition_name(table, month))
+                bounds = [month, self._add_months(month, 1)]
+
+                cursor.execute(f'CREATE TABLE {partition} (LIKE {name} INCLUDING DEFAULTS)')
+                cursor.execute(
+                    f'INSERT INTO {partition} SELECT * FROM {default} WHERE {column} >= %s AND {column} < %s',
+                    bounds
+                )
+                cursor.execute(f'DELETE FROM {default} WHERE {column} >= %s AND {column} < %s', bounds)
+                cursor.execute(
+                    f'ALTER TABLE {name} ATTACH PARTITION {partition} '
+                    f"FOR VALUES FROM ('{bounds[0].isoformat()}') TO ('{bounds[1].isoformat()}')"
+                )
+                created.append(self.partition_name(table, month))
+
+        return created
+
+    def drop_expired(self, table: PartitionedTable) -> List[str]:
+        """
+        Отсоединяет и удаляет (или только отсоединяет при detach_only) секции старше срока хранения.
+
+        Возвращает:
+            list: Имена обработанных секций.
+        """
+        if table.retention_months is None:
+            return []
+
+        boundary = self._add_months(self._month_start(django_timezone.now()), -table.retention_months)
+        expired = []
+
+        with connection.cursor() as cursor:
+            for partition, month in self.partitions(table).items():
+                if month is None or self._add_months(month, 1) > boundary:
+                    continue
+
+                cursor.execute(f'ALTER TABLE {connection.ops.quote_name(table.table)} '
+                               f'DETACH PARTITION {connection.ops.quote_name(partition)}')
+
+                if not self.detach_only:
+                    cursor.execute(f'DROP TABLE {connection.ops.quote_name(partition)}')
+
+                expired.append(partition)
+
+        return expired
+
+    def partitions(self, table: PartitionedTable) -> dict:
+        """
+        Возвращает секции таблицы и месяц каждой из них (None для секции по умолчанию).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = to_regclass(%s)
+            ''', [table.table])
+
+            names = [row[0] for row in cursor.fetchall()]
+
+        prefix = f'{table.table}_p'
+
+        return {
+            name: datetime.strptime(name[len(prefix):], '%Y%m').replace(tzinfo=timezone.utc)
+            if name.startswith(prefix) else None
+            for name in names
+        }
+
+    def partition_name(self, table: PartitionedTable, month: datetime) -> str:
+        return f'{table.table}_p{month:%Y%m}'
+
+    def _month_start(self, value: datetime) -> datetime:
+        value = value.astimezone(timezone.utc)
+
+        return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+    def _add_months(self, value: datetime, months: int) -> datetime:
+        month = value.month - 1 + months
+
+        return value.replace(year=value.year + month // 12, month=month % 12 + 1)
@@ -0,0 +1,93 @@
+from datetime import datetime
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from django.core.cache import cache
+
+from .models import Rate
+
+
+class LatestRate(NamedTuple):
+    cost: float
+    timestamp: datetime
+
+
+class LatestRateService:
+    """
+    Общий кэш последних курсов валют с ключом по идентификатору валюты.
+
+    Промахи догружаются из базы одним запросом DISTINCT ON на все недостающие
+    валюты сразу. После вставки новых курсов кэш обновляется через refresh.
+    """
+
+    KEY_PREFIX = 'latest-rate'
+    TIMEOUT = 3600
+
+    def key(self, currency_id: int) -> str:
+        return f'{self.KEY_PREFIX}:{currency_id}'
+
+    def get(self, currency_id: int) -> Optional[LatestRate]:
+        """
+        Возвращает последний курс валюты или None, если курсов нет.
+        """
+        return self.get_many([currency_id]).get(currency_id)
+
+    def get_many(self, currency_ids: Iterable[int]) -> Dict[int, LatestRate]:
+        """
+        Возвращает последние курсы для набора валют.
+
+        Аргументы:
+            currency_ids (iterable): Идентификаторы валют.
+
+        Возвращает:
+            dict: Сопоставление идентификатора валюты с LatestRate. Валюты без курсов отсутствуют.
+        """
+        keys = {self.key(currency_id): currency_id for currency_id in set(currency_ids)}
+
+        if not keys:
+            return {}
+
+        cached = cache.get_many(keys.keys())
+        rates = {keys[key]: rate for key, rate in cached.items()}
+
+        missing = [currency_id for key, currency_id in keys.items() if key not in cached]
+
+        if missing:
+            rates.update(self.refresh(missing))
+
+        return {currency_id: rate for currency_id, rate in rates.items() if rate is not None}
+
+    def refresh(self, currency_ids: Optional[Iterable[int]] = None) -> Dict[int, Optional[LatestRate]]:
+        """
+        Загружает последние курсы из базы и перезаписывает их в кэше.
+
+        Аргументы:
+            currency_ids (iterable | None): Идентификаторы валют. None обновляет все валюты с курсами.
+
+        Возвращает:
+            dict: Загруженные курсы. Для запрошенных валют без курсов значение None.
+        """
+        queryset = Rate.objects.order_by('currency_id', '-timestamp').distinct('currency_id')
+
+        if currency_ids is not None:
+            currency_ids = set(currency_ids)
+            queryset = queryset.filter(currency_id__in=currency_ids)
+
+        rates = {
+            currency_id: LatestRate(cost, timestamp)
+            for currency_id, cost, timestamp in queryset.values_list('currency_id', 'cost', 'timestamp')
+        }
+
+        if currency_ids is not None:
+            # Отсутствие курса тоже кэшируется, чтобы не повторять запрос
+            for currency_id in currency_ids:
+                rates.setdefault(currency_id, None)
+
+        cache.set_many({self.key(currency_id): rate for currency_id, rate in rates.items()}, timeout=self.TIMEOUT)
+
+        return rates
+
+    def invalidate(self, currency_ids: Iterable[int]):
+        cache.delete_many([self.key(currency_id) for currency_id in currency_ids])
+
+
+latest_rates = LatestRateService()
@@ -0,0 +1,223 @@
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Subquery
+from django.db.models.functions import Abs, NullIf
+
+from .models import Portfolio, PortfolioValue
+from .valuation import valuations as portfolio_valuations
+
+
+@dataclass
+class PortfolioValuation:
+    """
+    Результат переоценки одного портфеля.
+
+    Атрибуты:
+        portfolio_id (int): Идентификатор портфеля.
+        balance (float): Свободные средства портфеля.
+        total_value (float): Полная стоимость портфеля в рублях.
+        previous_value (float | None): Стоимость из последнего снимка PortfolioValue.
+    """
+    portfolio_id: int
+    balance: float
+    total_value: float
+    previous_value: Optional[float]
+
+
+@dataclass
+class ThresholdAlert:
+    """
+    Портфель, стоимость которого изменилась не меньше чем на его порог уведомления.
+
+    Атрибуты:
+        portfolio_id (int): Идентификатор портфеля.
+        total_value (float): Стоимость из нового снимка.
+        change_percent (float): Изменение относительно предыдущего снимка в процентах.
+        telegram_chat_id (int | None): Чат Telegram владельца.
+        email (str | None): Адрес электронной почты владельца.
+    """
+    portfolio_id: int
+    total_value: float
+    change_percent: float
+    telegram_chat_id: Optional[int]
+    email: Optional[str]
+
+
+@dataclass
+class RevaluationStats:
+    """
+    Статистика прогона переоценки.
+    """
+    rows: int = 0
+    chunks: int = 0
+    snapshots: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = self.elapsed
+
+        return self.rows / elapsed if elapsed > 0 else float(self.rows)
+
+    def __str__(self):
+        return (f'{self.rows} портфелей, {self.chunks} пакетов, {self.snapshots} снимков '
+                f'за {self.elapsed:.2f} с ({self.rows_per_second:.0f} строк/с)')
+
+
+class PortfolioRevaluationService:
+    """
+    Переоценивает все портфели набором пакетных запросов вместо обхода
+    каждого портфеля и каждой валюты по отдельности.
+
+    На пакет портфелей приходится три запроса: сами портфели (keyset по id),
+    агрегированные остатки валют (PortfolioValuationCache.build_many) и последний
+    снимок стоимости (DISTINCT ON). Последние курсы берутся из общего кэша.
+    Пороги уведомлений проверяются в базе после записи снимков (threshold_alerts).
+    """
+
+    CHUNK_SIZE = 1000
+
+    def __init__(self, chunk_size: Optional[int] = None, epsilon: Optional[float] = None):
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.epsilon = settings.PORTFOLIO_VALUE_EPSILON if epsilon is None else epsilon
+        self.stats = RevaluationStats()
+
+    def revalue(self) -> Iterator[List[PortfolioValuation]]:
+        """
+        Последовательно отдаёт переоценённые пакеты портфелей.
+
+        Возвращает:
+            iterator: Списки объектов PortfolioValuation размером не более chunk_size.
+        """
+        self.stats = RevaluationStats()
+
+        for chunk in self._portfolio_chunks():
+            # Кэш не перезаписывается: за время прогона курсы могли смениться и сбросить оценки
+            current = portfolio_valuations.build_many(dict(chunk))
+            previous_values = self._previous_values(list(current))
+
+            valuations = [
+                PortfolioValuation(
+                    portfolio_id=portfolio_id,
+                    balance=balance,
+                    total_value=current[portfolio_id].total,
+                    previous_value=previous_values.get(portfolio_id)
+                )
+                for portfolio_id, balance in chunk
+            ]
+
+            self.stats.rows += len(valuations)
+            self.stats.chunks += 1
+
+            yield valuations
+
+        self.stats.finished_at = time.monotonic()
+
+    def save_snapshots(self, valuations: List[PortfolioValuation]) -> List[int]:
+        """
+        Сохраняет снимки PortfolioValue для пакета одной вставкой в одной транзакции.
+
+        Портфели, стоимость которых изменилась не более чем на epsilon
+        относительно последнего снимка, пропускаются.
+
+        Аргументы:
+            valuations (list): Пакет объектов PortfolioValuation.
+
+        Возвращает:
+            list: Идентификаторы портфелей, для которых записаны снимки.
+        """
+        snapshots = [
+            PortfolioValue(portfolio_id=valuation.portfolio_id, value=valuation.total_value)
+            for valuation in valuations
+            if valuation.previous_value is None
+            or abs(valuation.total_value - valuation.previous_value) > self.epsilon
+        ]
+
+        if snapshots:
+            with transaction.atomic():
+                PortfolioValue.objects.bulk_create(snapshots, batch_size=self.chunk_size)
+
+        self.stats.snapshots += len(snapshots)
+
+        return [snapshot.portfolio_id for snapshot in snapshots]
+
+    def threshold_alerts(self, portfolio_ids: List[int], since: datetime) -> List[ThresholdAlert]:
+        """
+        Находит портфели, изменение стоимости которых достигло порога уведомления.
+
+        Вызывается после save_snapshots с идентификаторами записанных им портфелей,
+        поэтому снимки покупок и продаж других портфелей проверку не запускают.
+        Проверка целиком выполняется в базе: берутся только портфели с заданным
+        порогом, последний снимок сравнивается с предыдущим по индексу
+        (portfolio, -timestamp), а в Python возвращаются лишь сработавшие портфели
+        вместе с контактами владельца.
+
+        Аргументы:
+            portfolio_ids (list): Портфели, для которых save_snapshots записал снимки.
+            since (datetime): Момент перед записью снимков. Более старый последний
+                снимок означает, что проверять нечего.
+
+        Возвращает:
+            list: Объекты ThresholdAlert.
+        """
+        return [ThresholdAlert(*row) for row in self.breaching_portfolios(portfolio_ids, since)]
+
+    def breaching_portfolios(self, portfolio_ids: List[int], since: datetime):
+        """
+        Запрос сработавших порогов: строки (id, стоимость, изменение в процентах, чат Telegram, email).
+        """
+        snapshots = PortfolioValue.objects.filter(portfolio_id=OuterRef('pk')).order_by('-timestamp')
+
+        return (
+            Portfolio.objects
+            .filter(id__in=portfolio_ids, notify_threshold__isnull=False)
+            .alias(
+                current_timestamp=Subquery(snapshots.values('timestamp')[:1]),
+                previous_value=Subquery(snapshots.values('value')[1:2])
+            )
+            .filter(current_timestamp__gte=since)
+            .annotate(
+                current_value=Subquery(snapshots.values('value')[:1]),
+                change_percent=(F('current_value') - F('previous_value')) * 100.0 / NullIf(F('previous_value'), 0.0)
+            )
+            .alias(change=Abs('change_percent', output_field=FloatField()))
+            .filter(change__gte=F('notify_threshold'))
+            .values_list('id', 'current_value', 'change_percent', 'account__telegram_chat_id', 'account__email')
+        )
+
+    def _portfolio_chunks(self) -> Iterator[list]:
+        last_id = 0
+
+        while True:
+            chunk = list(
+                Portfolio.objects
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'balance')[:self.chunk_size]
+            )
+
+            if not chunk:
+                return
+
+            yield chunk
+
+            last_id = chunk[-1][0]
+
+    def _previous_values(self, portfolio_ids: List[int]) -> Dict[int, float]:
+        return dict(
+            PortfolioValue.objects
+            .filter(portfolio_id__in=portfolio_ids)
+            .order_by('portfolio_id', '-timestamp')
+            .distinct('portfolio_id')
+            .values_list('portfolio_id', 'value')
+        )
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Rate, RateRollup
+
+
+class RateRollupService:
+    """
+    Поддерживает OHLC-агрегаты курсов по часам, дням и неделям.
+
+    Границы корзин считаются в часовом поясе проекта, чтобы курс ЦБ РФ,
+    установленный на местную полночь, попадал в свой день.
+
+    Пересчитываются только корзины, начиная с корзины, в которую попадает
+    начало окна загрузки. Для валют без агрегатов они строятся по всей истории.
+    """
+
+    EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def update(self, since: Dict[int, Optional[datetime]]) -> int:
+        """
+        Пересчитывает агрегаты затронутых корзин всех разрешений.
+
+        Аргументы:
+            since (dict): Для каждой валюты - самое раннее время изменённых курсов
+                          (None - пересчитать всю историю).
+
+        Возвращает:
+            int: Количество вставленных или обновлённых агрегатов.
+        """
+        if not since:
+            return 0
+
+        rolled_up = set(
+            RateRollup.objects.filter(currency_id__in=since.keys()).values_list('currency_id', flat=True).distinct()
+        )
+        currency_ids = list(since)
+        starts = [since[currency_id] if since[currency_id] and currency_id in rolled_up else self.EPOCH
+                  for currency_id in currency_ids]
+
+        rate_table = connection.ops.quote_name(Rate._meta.db_table)
+        rollup_table = connection.ops.quote_name(RateRollup._meta.db_table)
+        time_zone = settings.TIME_ZONE or 'UTC'
+        affected = 0
+
+        with connection.cursor() as cursor:
+            for resolution in RateRollup.Resolution.values:
+                cursor.execute(f'''
+                    INSERT INTO {rollup_table} (currency_id, resolution, bucket, open, high, low, close, count)
+                    SELECT rate.currency_id,
+                           %s,
+                           date_trunc(%s, rate."timestamp", %s) AS bucket,
+                           (array_agg(rate.cost ORDER BY rate."timestamp"))[1],
+                           max(rate.cost),
+                           min(rate.cost),
+                           (array_agg(rate.cost ORDER BY rate."timestamp" DESC))[1],
+                           count(*)
+                    FROM {rate_table} AS rate
+                    JOIN unnest(%s::bigint[], %s::timestamptz[]) AS since(currency_id, start)
+                      ON since.currency_id = rate.currency_id
+                    WHERE rate."timestamp" >= date_trunc(%s, since.start, %s)
+                    GROUP BY rate.currency_id, bucket
+                    ON CONFLICT (currency_id, resolution, bucket) DO UPDATE SET
+                        open = EXCLUDED.open,
+                        high = EXCLUDED.high,
+                        low = EXCLUDED.low,
+                        close = EXCLUDED.close,
+                        count = EXCLUDED.count
+                ''', [resolution, resolution.lower(), time_zone, currency_ids, starts,
+                      resolution.lower(), time_zone])
+
+                affected += cursor.rowcount
+
+        return affected
+
+
+rate_rollups = RateRollupService()
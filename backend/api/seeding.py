@@ -0,0 +1,56 @@
+from datetime import time
+
+from django.utils import timezone
+
+from .models import Account, Currency, CurrencyBalance, Operation, Portfolio, Rate, Watch
+
+
+def seed_portfolio_lists(size: int, suffix: str):
+    """
+    Создаёт данные для проверки числа запросов списков.
+
+    Аккаунт получает size // 5 портфелей с остатками всех валют, а первый из них -
+    все size операций и size отслеживаний, поэтому с размером растут и число
+    портфелей, и списки отдельного портфеля.
+
+    Аргументы:
+        size (int): Количество операций и отслеживаний.
+        suffix (str): Суффикс имени аккаунта и валют, уникальный в пределах базы.
+
+    Возвращает:
+        tuple: Аккаунт, список портфелей (первый - с операциями) и список валют.
+    """
+    account = Account.objects.create(username=f'queries-{suffix}', email=f'queries-{suffix}@example.com')
+    portfolios = Portfolio.objects.bulk_create([
+        Portfolio(account=account, balance=100000, notify_threshold=5)
+        for _ in range(max(1, size // 5))
+    ])
+
+    currencies = Currency.objects.bulk_create([
+        Currency(name=f'Queries {suffix} {index}', short_name=f'Q{suffix}-{index}', description='')
+        for index in range(max(1, size // 10))
+    ])
+
+    Rate.objects.bulk_create([
+        Rate(currency=currency, cost=10 + index, timestamp=timezone.now())
+        for index, currency in enumerate(currencies)
+    ])
+
+    CurrencyBalance.objects.bulk_create([
+        CurrencyBalance(portfolio=portfolio, currency=currency, amount=1)
+        for portfolio in portfolios
+        for currency in currencies
+    ])
+
+    Operation.objects.bulk_create([
+        Operation(portfolio=portfolios[0], currency=currencies[index % len(currencies)],
+                  operation_type=Operation.OperationType.BUY, amount=1, price=10)
+        for index in range(size)
+    ])
+
+    Watch.objects.bulk_create([
+        Watch(portfolio=portfolios[0], currency=currencies[index % len(currencies)], notify_time=time(9))
+        for index in range(size)
+    ])
+
+    return account, portfolios, currencies
@@ -1,8 +1,52 @@
 from django.contrib.auth import authenticate
+from django.db.models.manager import BaseManager
 
 from rest_framework import serializers
 
 from .models import *
+from .rates import latest_rates
+from .valuation import valuations
+
+
+class DynamicFieldsMixin:
+    """
+    Позволяет ограничить набор полей сериализатора аргументом fields.
+    Неизвестные имена полей игнорируются.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class PortfolioValuationListSerializer(serializers.ListSerializer):
+    """
+    Загружает оценки всех портфелей списка одним valuations.get_many и передаёт
+    их строкам через context['valuations'], чтобы total_balance не читал кэш построчно.
+
+    Атрибуты:
+        portfolio_field (str): Атрибут строки с идентификатором портфеля.
+    """
+    portfolio_field = 'id'
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        cached = self.context.setdefault('valuations', {})
+        missing = {getattr(item, self.portfolio_field) for item in items} - cached.keys()
+
+        if missing:
+            cached.update(valuations.get_many(missing))
+
+        return super().to_representation(items)
+
+
+class PortfolioItemValuationListSerializer(PortfolioValuationListSerializer):
+    portfolio_field = 'portfolio_id'
 
 
 class AuthLoginSerializer(serializers.Serializer):
@@ -122,28 +166,36 @@ class PortfolioSerializer(serializers.ModelSerializer):
                   'operations_count', 'watches_count', 'currencies_count',
                   'total_balance')
         read_only_fields = ('id',)
+        list_serializer_class = PortfolioValuationListSerializer
+
+    # Счётчики берутся из аннотаций Portfolio.objects.with_summary(), если они есть
 
     def get_operations_count(self, obj):
-        return obj.operations.count()
+        if hasattr(obj, 'operations_count'):
+            return obj.operations_count
+
+        return obj.operation_set.count()
 
     def get_watches_count(self, obj):
-        return obj.watches.count()
+        if hasattr(obj, 'watches_count'):
+            return obj.watches_count
+
+        return obj.watch_set.count()
 
     def get_currencies_count(self, obj):
+        if hasattr(obj, 'currencies_count'):
+            return obj.currencies_count
+
         return CurrencyBalance.objects.filter(portfolio=obj).count()
 
     def get_total_balance(self, obj):
-        total = obj.balance
-        currency_balances = CurrencyBalance.objects.filter(portfolio=obj).select_related('currency')
-        
-        for balance in currency_balances:
-            try:
-                current_rate = balance.currency.rate_set.latest('timestamp')
-                total += balance.amount * current_rate.cost
-            except Rate.DoesNotExist:
-                continue
-                
-        return total
+        # Списки заранее загружают оценки в контекст, одиночный портфель читает свою при первом обращении
+        cached = self.context.setdefault('valuations', {})
+
+        if obj.id not in cached:
+            cached[obj.id] = valuations.get(obj.id)
+
+        return cached[obj.id].total
 
 
 class PortfolioOperationSerializer(serializers.Serializer):
@@ -154,6 +206,40 @@ class PortfolioOperationSerializer(serializers.Serializer):
     amount = serializers.FloatField()
 
 
+class PortfolioOrderSerializer(serializers.Serializer):
+    operation_type = serializers.ChoiceField(choices=['buy', 'sell'])
+    # Валюты всех ног загружаются одним запросом в PortfolioOrdersSerializer
+    currency_id = serializers.IntegerField()
+    amount = serializers.FloatField()
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Количество должно быть положительным")
+
+        return value
+
+
+class PortfolioOrdersSerializer(serializers.Serializer):
+    MAX_ORDERS = 100
+
+    orders = PortfolioOrderSerializer(many=True, allow_empty=False)
+
+    def validate_orders(self, value):
+        if len(value) > self.MAX_ORDERS:
+            raise serializers.ValidationError(f"Не более {self.MAX_ORDERS} сделок в одной заявке")
+
+        currencies = Currency.objects.in_bulk({order['currency_id'] for order in value})
+        unknown = sorted({order['currency_id'] for order in value} - currencies.keys())
+
+        if unknown:
+            raise serializers.ValidationError(f"Неизвестные валюты: {', '.join(map(str, unknown))}")
+
+        for order in value:
+            order['currency'] = currencies[order.pop('currency_id')]
+
+        return value
+
+
 class CurrencySerializer(serializers.ModelSerializer):
     current_rate = serializers.SerializerMethodField()
 
@@ -164,12 +250,14 @@ class CurrencySerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_current_rate(self, obj):
-        latest_rate = obj.rate_set.order_by('-timestamp').first()
+        # Списки передают заранее загруженные курсы, чтобы не обращаться к кэшу на каждую строку
+        rates = self.context.get('latest_rates')
+        latest_rate = rates.get(obj.id) if rates is not None else latest_rates.get(obj.id)
 
         return latest_rate.cost if latest_rate else None
 
 
-class RateSerializer(serializers.ModelSerializer):
+class RateSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     currency = CurrencySerializer(read_only=True)
     currency_id = serializers.PrimaryKeyRelatedField(
         queryset=Currency.objects.all(),
@@ -184,6 +272,50 @@ class RateSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'timestamp')
 
 
+class RateFlatSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    currency_id = serializers.IntegerField(read_only=True)
+    timestamp = serializers.DateTimeField(format='%Y-%m-%d')
+
+    class Meta:
+        model = Rate
+        fields = ('id', 'currency_id', 'cost', 'timestamp')
+        read_only_fields = fields
+
+
+class RateRollupSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = RateRollup
+        fields = ('bucket', 'open', 'high', 'low', 'close', 'count')
+        read_only_fields = fields
+
+
+class RateQuerySerializer(serializers.Serializer):
+    """
+    Параметры списка курсов: fields - перечень полей через запятую,
+    flat - отдавать currency_id вместо вложенной валюты, from и to - границы периода.
+    """
+    flat = serializers.BooleanField(default=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # fields - атрибут сериализатора, а from - зарезервированное слово, поэтому параметры объявляются здесь
+        fields['fields'] = serializers.CharField(required=False, source='projection')
+        fields['from'] = serializers.DateTimeField(required=False, source='date_from')
+        fields['to'] = serializers.DateTimeField(required=False, source='date_to')
+
+        return fields
+
+    def validate_fields(self, value):
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class RateRangeSerializer(RateQuerySerializer):
+    resolution = serializers.ChoiceField(
+        choices=['raw'] + [resolution.lower() for resolution in RateRollup.Resolution.values],
+        default='raw'
+    )
+
+
 class CurrencyBalanceSerializer(serializers.ModelSerializer):
     currency = CurrencySerializer(read_only=True)
     current_price = serializers.SerializerMethodField()
@@ -194,19 +326,20 @@ class CurrencyBalanceSerializer(serializers.ModelSerializer):
         fields = ('currency', 'amount', 'current_price', 'total_value')
         read_only_fields = fields
 
+    def get_latest_rate(self, obj):
+        rates = self.context.get('latest_rates')
+
+        return rates.get(obj.currency_id) if rates is not None else latest_rates.get(obj.currency_id)
+
     def get_current_price(self, obj):
-        try:
-            return obj.currency.rate_set.latest('timestamp').cost
-        except Rate.DoesNotExist:
-            return None
+        latest_rate = self.get_latest_rate(obj)
+
+        return latest_rate.cost if latest_rate else None
 
     def get_total_value(self, obj):
-        try:
-            current_price = obj.currency.rate_set.latest('timestamp').cost
+        latest_rate = self.get_latest_rate(obj)
 
-            return obj.amount * current_price
-        except Rate.DoesNotExist:
-            return None
+        return obj.amount * latest_rate.cost if latest_rate else None
 
 
 class OperationSerializer(serializers.ModelSerializer):
@@ -230,6 +363,7 @@ class OperationSerializer(serializers.ModelSerializer):
                   'currency', 'currency_id', 'amount', 'price',
                   'total_amount', 'timestamp')
         read_only_fields = ('id', 'timestamp')
+        list_serializer_class = PortfolioItemValuationListSerializer
 
     def get_total_amount(self, obj):
         return obj.amount * obj.price
@@ -254,3 +388,4 @@ class WatchSerializer(serializers.ModelSerializer):
         fields = ('id', 'portfolio', 'portfolio_id', 'currency',
                   'currency_id', 'notify_time')
         read_only_fields = ('id', )
+        list_serializer_class = PortfolioItemValuationListSerializer
@@ -1,110 +1,106 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
-from .models import Watch, Rate, Portfolio, CurrencyBalance, PortfolioValue
-import asyncio
-import aiohttp
-
-async def send_telegram_notification(chat_id: int, message: str) -> bool:
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage",
-                json={
-                    "chat_id": chat_id,
-                    "text": message,
-                    "parse_mode": "HTML"
-                }
-            ) as response:
-                return response.status == 200
-    except Exception:
-        return False
+from .models import Notification, Watch
+from .notifications import render_rate_message, watch_dispatcher
+from .outbox import outbox
+from .partitions import PartitionManager
+from .rates import latest_rates
+from .revaluation import PortfolioRevaluationService
 
 @shared_task
 def notify_currency_rate(watch_id):
     try:
         watch = Watch.objects.select_related('portfolio__account', 'currency').get(id=watch_id)
-        latest_rate = Rate.objects.filter(currency=watch.currency).latest('timestamp')
-        
-        message = (
-            f"<b>Обновление курса валют</b>\n\n"
-            f"💱 {watch.currency.name} ({watch.currency.short_name})\n"
-            f"📈 Курс: {latest_rate.cost}\n"
-            f"⏰ Время: {latest_rate.timestamp}"
-        )
-
-        if watch.portfolio.account.telegram_chat_id:
-            try:
-                asyncio.run(send_telegram_notification(
-                    chat_id=watch.portfolio.account.telegram_chat_id,
-                    message=message
-                ))
-            except Exception:
-                pass
-
-        if watch.portfolio.account.email:
-            try:
-                send_mail(
-                    subject=f'Курс {watch.currency.short_name}',
-                    message=message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[watch.portfolio.account.email],
-                    fail_silently=True
-                )
-            except Exception:
-                pass
-        
-    except (Watch.DoesNotExist, Rate.DoesNotExist):
+        latest_rate = latest_rates.get(watch.currency_id)
+
+        if latest_rate is None:
+            return
+
+        account = watch.portfolio.account
+
+        outbox.enqueue(outbox.build(
+            subject=f'Курс {watch.currency.short_name}',
+            message=render_rate_message(watch.currency, latest_rate),
+            chat_ids=[account.telegram_chat_id] if account.telegram_chat_id else [],
+            emails=[account.email] if account.email else []
+        ))
+    except Watch.DoesNotExist:
         pass
 
+@shared_task
+def dispatch_watch_notifications():
+    queued = 0
+
+    for batch in watch_dispatcher.dispatch():
+        queued += outbox.enqueue(outbox.build(batch.subject, batch.message, batch.chat_ids, batch.emails))
+
+    if queued:
+        print(f"Уведомления об отслеживаемых валютах: {queued} в очереди")
+
+@shared_task
+def send_watch_notifications(subject, message, chat_ids, emails):
+    # Оставлена для задач, поставленных в очередь Celery до перехода на outbox
+    outbox.enqueue(outbox.build(subject, message, chat_ids, emails))
+
+def route_notifications(name, args, kwargs, options, task=None, **kw):
+    # Доставка в Telegram идёт в отдельную очередь с одним процессом, иначе
+    # каждый процесс воркера расходует лимит бота независимо от остальных
+    if name != 'api.tasks.deliver_notifications':
+        return None
+
+    channel = args[0] if args else (kwargs or {}).get('channel')
+
+    if channel == Notification.Channel.TELEGRAM:
+        return {'queue': settings.TELEGRAM_QUEUE}
+
+    return None
+
+@shared_task
+def deliver_notifications(channel):
+    # Канал обязателен: без него задача разобрала бы и Telegram в обход его очереди
+    stats = outbox.process(channel)
+
+    if stats.batches:
+        print(f"Доставка уведомлений: {stats}")
+
 @shared_task
 def update_portfolio_values():
-    portfolios = Portfolio.objects.all()
-
-    for portfolio in portfolios:
-        total_value = portfolio.balance
-        
-        currency_balances = CurrencyBalance.objects.filter(portfolio=portfolio).select_related('currency')
-
-        for balance in currency_balances:
-            try:
-                current_rate = balance.currency.rate_set.latest('timestamp')
-                total_value += balance.amount * current_rate.cost
-            except Rate.DoesNotExist:
-                continue
-
-        try:
-            last_value = PortfolioValue.objects.filter(portfolio=portfolio).latest('timestamp')
-            change_percent = ((total_value - last_value.value) / last_value.value) * 100
-
-            if portfolio.notify_threshold is not None and abs(change_percent) >= portfolio.notify_threshold:
-                message = (
-                    f"<b>Изменение стоимости портфеля</b>\n\n"
-                    f"💰 Текущая стоимость: {total_value}\n"
-                    f"📈 Изменение: {'+' if change_percent > 0 else ''}{change_percent:.2f}%\n"
-                    f"⏰ Время: {timezone.now().strftime('%H:%M:%S')}"
-                )
-                
-                if portfolio.account.telegram_chat_id:
-                    try:
-                        asyncio.run(send_telegram_notification(
-                            chat_id=portfolio.account.telegram_chat_id,
-                            message=message
-                        ))
-                    except Exception:
-                        pass
-
-                if portfolio.account.email:
-                    try:
-                        send_mail(
-                            subject=f'Изменение стоимости портфеля',
-                            message=message,
-                            from_email=settings.DEFAULT_FROM_EMAIL,
-                            recipient_list=[portfolio.account.email],
-                            fail_silently=True
-                        )
-                    except Exception:
-                        pass
-        except PortfolioValue.DoesNotExist:
-            pass
+    service = PortfolioRevaluationService()
+
+    for valuations in service.revalue():
+        written_at = timezone.now()
+        written = service.save_snapshots(valuations)
+
+        # Без новых снимков изменений стоимости нет и проверять пороги не нужно
+        if not written:
+            continue
+
+        notifications = []
+
+        for alert in service.threshold_alerts(written, since=written_at):
+            change_percent = alert.change_percent
+
+            message = (
+                f"<b>Изменение стоимости портфеля</b>\n\n"
+                f"💰 Текущая стоимость: {alert.total_value}\n"
+                f"📈 Изменение: {'+' if change_percent > 0 else ''}{change_percent:.2f}%\n"
+                f"⏰ Время: {timezone.now().strftime('%H:%M:%S')}"
+            )
+
+            notifications += outbox.build(
+                subject='Изменение стоимости портфеля',
+                message=message,
+                chat_ids=[alert.telegram_chat_id] if alert.telegram_chat_id else [],
+                emails=[alert.email] if alert.email else []
+            )
+
+        outbox.enqueue(notifications)
+
+    print(f"Переоценка портфелей: {service.stats}")
+
+
+@shared_task
+def maintain_partitions():
+    for action in PartitionManager().maintain():
+        print(f"Секционирование: {action}")
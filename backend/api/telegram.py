@@ -0,0 +1,185 @@
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import aiohttp
+from django.conf import settings
+
+from .delivery import DeliveryStats
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты «маркерная корзина».
+
+    Атрибуты:
+        rate (float): Маркеров в секунду.
+        capacity (float): Максимальный запас маркеров (допустимый всплеск).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.resume_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+
+                if now < self.resume_at:
+                    await asyncio.sleep(self.resume_at - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Приостанавливает выдачу маркеров, например по retry_after из ответа 429.
+        """
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class TelegramSender:
+    """
+    Доставка сообщений через Bot API с общим пулом соединений.
+
+    Сессия aiohttp и цикл событий живут всё время процесса воркера и переиспользуются
+    между задачами. Частота ограничивается общей корзиной (лимит бота) и корзиной
+    на каждый чат, ответ 429 приостанавливает отправку на retry_after секунд.
+    Сообщения отправляются конкурентно пакетами через asyncio.gather.
+
+    Корзины живут в памяти процесса, поэтому лимит бота соблюдается, только пока
+    отправляет один процесс: задачи доставки в Telegram направляются в очередь
+    TELEGRAM_QUEUE, которую разбирает воркер с --concurrency 1.
+    """
+
+    API_URL = 'https://api.telegram.org/bot{token}/sendMessage'
+    RETRIES = 3
+    RETRY_BACKOFF = 1.0
+    REQUEST_TIMEOUT = 10
+    BATCH_SIZE = 100
+    # Корзины чатов без активности очищаются, чтобы словарь не рос бесконечно
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                 connections: Optional[int] = None):
+        self.global_rate = global_rate or settings.TELEGRAM_GLOBAL_RATE
+        self.chat_rate = chat_rate or settings.TELEGRAM_CHAT_RATE
+        self.connections = connections or settings.TELEGRAM_MAX_CONNECTIONS
+        self._pid = None
+        self._loop = None
+        self._session = None
+        self._global_bucket = None
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def send_many(self, messages: Iterable[Tuple[int, str]]) -> DeliveryStats:
+        """
+        Отправляет сообщения из синхронного кода (задач Celery).
+
+        Аргументы:
+            messages (iterable): Пары (chat_id, текст).
+
+        Возвращает:
+            DeliveryStats: Итоги доставки.
+        """
+        return self._event_loop().run_until_complete(self.deliver(messages))
+
+    async def deliver(self, messages: Iterable[Tuple[int, str]]) -> DeliveryStats:
+        stats = DeliveryStats()
+        messages = list(messages)
+
+        for offset in range(0, len(messages), self.BATCH_SIZE):
+            results = await asyncio.gather(*(
+                self.send(chat_id, text, stats) for chat_id, text in messages[offset:offset + self.BATCH_SIZE]
+            ))
+
+            stats.results.extend(results)
+            stats.sent += sum(results)
+            stats.failed += len(results) - sum(results)
+
+            if len(self._chat_buckets) > self.MAX_CHAT_BUCKETS:
+                self._chat_buckets.clear()
+
+        return stats
+
+    async def send(self, chat_id: int, text: str, stats: Optional[DeliveryStats] = None) -> bool:
+        """
+        Отправляет одно сообщение с соблюдением лимитов и повторами.
+
+        Возвращает:
+            bool: True, если Telegram принял сообщение.
+        """
+        session = await self._get_session()
+        chat_bucket = self._chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, 1))
+
+        for attempt in range(self.RETRIES + 1):
+            await chat_bucket.acquire()
+            await self._global_bucket.acquire()
+
+            try:
+                async with session.post(
+                    self.API_URL.format(token=settings.TELEGRAM_BOT_TOKEN),
+                    json={
+                        "chat_id": chat_id,
+                        "text": text,
+                        "parse_mode": "HTML"
+                    }
+                ) as response:
+                    if response.status == 200:
+                        return True
+
+                    if response.status == 429:
+                        payload = await response.json(content_type=None)
+                        retry_after = payload.get('parameters', {}).get('retry_after', self.RETRY_BACKOFF)
+                        self._global_bucket.pause(retry_after)
+                    elif response.status < 500:
+                        # Ошибки клиента (чат не найден, бот заблокирован) повторять бессмысленно
+                        return False
+                    else:
+                        await asyncio.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+
+            if stats is not None and attempt < self.RETRIES:
+                stats.retried += 1
+
+        return False
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        # Воркеры Celery порождаются fork, цикл и сессия создаются заново в каждом процессе
+        if self._pid != os.getpid() or self._loop is None or self._loop.is_closed():
+            self._pid = os.getpid()
+            self._loop = asyncio.new_event_loop()
+            self._session = None
+            self._global_bucket = None
+            self._chat_buckets = {}
+
+        return self._loop
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.REQUEST_TIMEOUT)
+            )
+
+        if self._global_bucket is None:
+            self._global_bucket = TokenBucket(self.global_rate)
+
+        return self._session
+
+
+telegram = TelegramSender()
@@ -0,0 +1,217 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from .models import Account, Currency, CurrencyBalance, Operation, Portfolio, Rate
+from .partitions import PartitionedTable, PartitionManager
+from .rates import latest_rates
+from .seeding import seed_portfolio_lists
+from .trading import TradeError, trades
+from .valuation import valuations
+
+
+class ListQueryCountTests(APITestCase):
+    """
+    Число запросов списков портфелей, операций и отслеживаний не зависит
+    ни от числа строк, ни от числа портфелей, в том числе при холодном кэше
+    оценок и курсов.
+    """
+
+    SIZES = (5, 50)
+    ENDPOINTS = (
+        ('api:portfolio-list', False),
+        ('api:portfolio-detail', True),
+        ('api:operation-list', False),
+        ('api:watch-list', False),
+        ('api:portfolio-operations', True),
+        ('api:portfolio-watches', True),
+    )
+
+    def seed(self, size):
+        account, portfolios, currencies = seed_portfolio_lists(size, str(size))
+
+        self.addCleanup(valuations.invalidate, [portfolio.id for portfolio in portfolios])
+        self.addCleanup(latest_rates.invalidate, [currency.id for currency in currencies])
+
+        return account, portfolios, currencies
+
+    def request(self, name, detail, account, portfolios, currencies):
+        """
+        Запрашивает список на холодном кэше: оценки и курсы сбрасываются перед запросом.
+        """
+        valuations.invalidate(portfolio.id for portfolio in portfolios)
+        latest_rates.invalidate(currency.id for currency in currencies)
+
+        self.client.force_authenticate(user=account)
+        response = self.client.get(reverse(name, kwargs={'pk': portfolios[0].pk} if detail else None))
+        self.assertEqual(response.status_code, 200)
+
+        return response
+
+    def test_query_count_does_not_depend_on_size(self):
+        small, *larger = [self.seed(size) for size in self.SIZES]
+
+        for name, detail in self.ENDPOINTS:
+            with CaptureQueriesContext(connection) as queries:
+                self.request(name, detail, *small)
+
+            for data in larger:
+                with self.subTest(endpoint=name, portfolios=len(data[1])):
+                    with self.assertNumQueries(len(queries)):
+                        self.request(name, detail, *data)
+
+    def test_portfolio_lists_query_count_does_not_depend_on_rows(self):
+        """
+        Операции и отслеживания одного портфеля: портфель со счётчиками загружается
+        один раз, а не для каждой строки.
+        """
+        small, larger = self.seed(10), self.seed(200)
+
+        for name in ('api:portfolio-operations', 'api:portfolio-watches'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.request(name, True, *small)
+
+            self.assertEqual(len(response.data), 10)
+
+            with self.subTest(endpoint=name):
+                with self.assertNumQueries(len(queries)):
+                    response = self.request(name, True, *larger)
+
+                self.assertEqual(len(response.data), 200)
+
+
+class ConcurrentTradeTests(TransactionTestCase):
+    """
+    Параллельные сделки одного портфеля из разных соединений не уводят баланс
+    и остатки в минус и не теряют обновлений.
+    """
+
+    PRICE = 10.0
+    AFFORDABLE = 20
+    REQUESTS = 60
+    WORKERS = 16
+
+    def setUp(self):
+        account = Account.objects.create(username='concurrent', email='concurrent@example.com')
+        self.portfolio = Portfolio.objects.create(account=account, balance=self.AFFORDABLE * self.PRICE)
+        self.currency = Currency.objects.create(name='Concurrent', short_name='CNC', description='')
+
+        Rate.objects.create(currency=self.currency, cost=self.PRICE, timestamp=timezone.now())
+        latest_rates.refresh([self.currency.id])
+
+        self.addCleanup(valuations.invalidate, [self.portfolio.id])
+        self.addCleanup(latest_rates.invalidate, [self.currency.id])
+
+    def trade(self, side):
+        try:
+            getattr(trades, side)(self.portfolio.id, self.currency, 1)
+
+            return True
+        except TradeError:
+            return False
+        finally:
+            # Каждый поток работает со своим соединением
+            connection.close()
+
+    def run_concurrently(self, side):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            return list(executor.map(self.trade, [side] * self.REQUESTS))
+
+    def holding(self):
+        return CurrencyBalance.objects.filter(
+            portfolio=self.portfolio, currency=self.currency
+        ).values_list('amount', flat=True).first() or 0
+
+    def test_buys_do_not_overdraw_balance(self):
+        results = self.run_concurrently('buy')
+
+        self.portfolio.refresh_from_db()
+
+        self.assertEqual(results.count(True), self.AFFORDABLE)
+        self.assertAlmostEqual(self.portfolio.balance, 0)
+        self.assertAlmostEqual(self.holding(), self.AFFORDABLE)
+        self.assertEqual(Operation.objects.filter(portfolio=self.portfolio).count(), self.AFFORDABLE)
+
+    def test_sells_do_not_oversell_holding(self):
+        for _ in range(self.AFFORDABLE):
+            trades.buy(self.portfolio.id, self.currency, 1)
+
+        results = self.run_concurrently('sell')
+
+        self.portfolio.refresh_from_db()
+
+        self.assertEqual(results.count(True), self.AFFORDABLE)
+        self.assertAlmostEqual(self.portfolio.balance, self.AFFORDABLE * self.PRICE)
+        self.assertAlmostEqual(self.holding(), 0)
+        self.assertAlmostEqual(valuations.get(self.portfolio.id).total, self.AFFORDABLE * self.PRICE)
+
+
+class PartitionManagerTests(TestCase):
+    """
+    Секционирование таблицы курсов на тестовой базе PostgreSQL: DDL выполняется
+    в транзакции теста и откатывается вместе с ней.
+    """
+
+    RETENTION_MONTHS = 12
+
+    def setUp(self):
+        self.manager = PartitionManager(months_ahead=2, detach_only=False)
+        self.table = PartitionedTable(Rate._meta.db_table, 'timestamp', self.RETENTION_MONTHS)
+        self.manager.tables = [self.table]
+        self.currency = Currency.objects.create(name='Partitioned', short_name='PRT', description='')
+        self.now = timezone.now()
+
+    def add_rate(self, months_ago: int) -> Rate:
+        return Rate.objects.create(currency=self.currency, cost=1, timestamp=self.now - timedelta(days=31 * months_ago))
+
+    def month_partition(self, months_ago: int) -> str:
+        return self.manager.partition_name(
+            self.table, self.manager._month_start(self.now - timedelta(days=31 * months_ago))
+        )
+
+    def default_rows(self) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {connection.ops.quote_name(self.table.table + "_default")}')
+
+            return cursor.fetchone()[0]
+
+    def test_convert_keeps_rows_and_continues_ids(self):
+        existing = [self.add_rate(months_ago) for months_ago in (0, 3)]
+
+        self.manager.convert(self.table)
+
+        self.assertTrue(self.manager.is_partitioned(self.table))
+        self.assertEqual(set(Rate.objects.values_list('id', flat=True)), {rate.id for rate in existing})
+        self.assertIn(self.month_partition(3), self.manager.partitions(self.table))
+        self.assertIn(self.month_partition(-2), self.manager.partitions(self.table))
+        self.assertEqual(self.default_rows(), 0)
+
+        rate = self.add_rate(1)
+
+        self.assertGreater(rate.id, max(rate.id for rate in existing))
+
+    def test_maintain_splits_default_partition_and_drops_expired_rows(self):
+        self.add_rate(0)
+        self.manager.convert(self.table)
+
+        backfilled = self.add_rate(self.RETENTION_MONTHS + 6)
+        future = self.add_rate(-6)
+
+        self.assertEqual(self.default_rows(), 2)
+
+        actions = self.manager.maintain()
+
+        self.assertEqual(self.default_rows(), 0)
+        self.assertTrue(any(self.month_partition(-6) in action for action in actions))
+        self.assertNotIn(self.month_partition(self.RETENTION_MONTHS + 6), self.manager.partitions(self.table))
+        self.assertFalse(Rate.objects.filter(id=backfilled.id).exists())
+        self.assertTrue(Rate.objects.filter(id=future.id).exists())
+
+        # Повторный запуск ничего не меняет, месяц выделенной секции создаётся без ошибок
+        self.assertEqual(self.manager.maintain(), [])
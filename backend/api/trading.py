@@ -0,0 +1,282 @@
+from dataclasses import dataclass
+from typing import List
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Currency, CurrencyBalance, Operation, Portfolio, PortfolioValue
+from .rates import latest_rates
+from .valuation import Valuation, valuations
+
+
+class TradeError(Exception):
+    """
+    Сделка отклонена. Текст исключения показывается пользователю.
+    """
+
+
+@dataclass
+class TradeResult:
+    """
+    Результат сделки.
+
+    Атрибуты:
+        operation (Operation): Созданная операция.
+        valuation (Valuation): Оценка портфеля после сделки.
+    """
+    operation: Operation
+    valuation: Valuation
+
+
+@dataclass
+class Order:
+    """
+    Одна нога пакетной заявки.
+
+    Атрибуты:
+        operation_type (str): buy или sell.
+        currency (Currency): Валюта.
+        amount (float): Количество валюты.
+    """
+    operation_type: str
+    currency: Currency
+    amount: float
+
+
+@dataclass
+class BatchResult:
+    """
+    Результат пакетной заявки.
+
+    Атрибуты:
+        operations (list): Созданные операции в порядке ног заявки.
+        valuation (Valuation): Оценка портфеля после всех сделок.
+    """
+    operations: List[Operation]
+    valuation: Valuation
+
+
+class TradeService:
+    """
+    Исполнение покупок и продаж валюты, общее для API и веб-интерфейса.
+
+    Проверка средств и списание выполняются одним условным UPDATE с F-выражением,
+    поэтому параллельные сделки не теряют обновления и не уводят баланс в минус.
+    Первой всегда изменяется строка портфеля: её блокировка упорядочивает сделки
+    одного портфеля и исключает взаимные блокировки с остатками валют.
+    """
+
+    EPSILON = 1e-10
+
+    def buy(self, portfolio_id: int, currency: Currency, amount: float) -> TradeResult:
+        """
+        Покупает валюту по последнему курсу.
+
+        Аргументы:
+            portfolio_id (int): Идентификатор портфеля.
+            currency (Currency): Покупаемая валюта.
+            amount (float): Количество валюты.
+
+        Возвращает:
+            TradeResult: Операция и оценка портфеля после сделки.
+        """
+        price = self._price(currency, amount)
+        total_cost = amount * price
+
+        with transaction.atomic():
+            debited = Portfolio.objects.filter(
+                id=portfolio_id,
+                balance__gte=total_cost
+            ).update(balance=F('balance') - total_cost)
+
+            if not debited:
+                raise TradeError("Недостаточно средств на балансе")
+
+            credited = CurrencyBalance.objects.filter(
+                portfolio_id=portfolio_id,
+                currency=currency
+            ).update(amount=F('amount') + amount)
+
+            if not credited:
+                CurrencyBalance.objects.create(portfolio_id=portfolio_id, currency=currency, amount=amount)
+
+            return self._record(portfolio_id, currency, 'buy', amount, price, holder_changed=not credited)
+
+    def sell(self, portfolio_id: int, currency: Currency, amount: float) -> TradeResult:
+        """
+        Продаёт валюту по последнему курсу.
+
+        Аргументы:
+            portfolio_id (int): Идентификатор портфеля.
+            currency (Currency): Продаваемая валюта.
+            amount (float): Количество валюты.
+
+        Возвращает:
+            TradeResult: Операция и оценка портфеля после сделки.
+        """
+        price = self._price(currency, amount)
+
+        with transaction.atomic():
+            Portfolio.objects.filter(id=portfolio_id).update(balance=F('balance') + amount * price)
+
+            debited = CurrencyBalance.objects.filter(
+                portfolio_id=portfolio_id,
+                currency=currency,
+                amount__gte=amount
+            ).update(amount=F('amount') - amount)
+
+            if not debited:
+                if CurrencyBalance.objects.filter(portfolio_id=portfolio_id, currency=currency).exists():
+                    raise TradeError("Недостаточно валюты для продажи")
+
+                raise TradeError("У вас нет этой валюты")
+
+            emptied, _ = CurrencyBalance.objects.filter(
+                portfolio_id=portfolio_id,
+                currency=currency,
+                amount__lt=self.EPSILON
+            ).delete()
+
+            return self._record(portfolio_id, currency, 'sell', amount, price, holder_changed=bool(emptied))
+
+    def execute(self, portfolio_id: int, orders: List[Order]) -> BatchResult:
+        """
+        Исполняет пакет покупок и продаж одной транзакцией.
+
+        Ноги применяются и проверяются по порядку под блокировкой строки портфеля:
+        каждая продажа покрывается остатком на момент этой ноги, каждая покупка -
+        средствами на этот момент, поэтому выручка от продажи оплачивает только
+        следующие за ней покупки. Курсы загружаются одним обращением, операции и
+        остатки записываются пакетно, снимок стоимости создаётся один.
+
+        Аргументы:
+            portfolio_id (int): Идентификатор портфеля.
+            orders (list): Ноги заявки Order.
+
+        Возвращает:
+            BatchResult: Операции и оценка портфеля после исполнения.
+        """
+        if not orders:
+            raise TradeError("Заявка не содержит сделок")
+
+        if any(order.amount <= 0 for order in orders):
+            raise TradeError("Количество должно быть положительным")
+
+        currencies = {order.currency.id: order.currency for order in orders}
+        rates = latest_rates.get_many(currencies)
+
+        for currency_id, currency in currencies.items():
+            if currency_id not in rates:
+                raise TradeError(f"Нет доступных курсов для валюты {currency.short_name}")
+
+        with transaction.atomic():
+            portfolio = Portfolio.objects.select_for_update().only('id', 'balance').filter(id=portfolio_id).first()
+
+            if portfolio is None:
+                raise TradeError("Портфель не найден")
+
+            balances = {
+                balance.currency_id: balance
+                for balance in CurrencyBalance.objects.select_for_update().filter(
+                    portfolio_id=portfolio_id,
+                    currency_id__in=currencies
+                )
+            }
+
+            cash = portfolio.balance
+            amounts = {
+                currency_id: balances[currency_id].amount if currency_id in balances else 0
+                for currency_id in currencies
+            }
+
+            # Ноги применяются по порядку: продать можно только то, что есть к этой ноге
+            for order in orders:
+                currency_id = order.currency.id
+                cost = order.amount * rates[currency_id].cost
+
+                if order.operation_type == 'buy':
+                    if cash < cost:
+                        raise TradeError("Недостаточно средств на балансе")
+
+                    cash -= cost
+                    amounts[currency_id] += order.amount
+                else:
+                    if amounts[currency_id] < self.EPSILON:
+                        raise TradeError(f"У вас нет валюты {order.currency.short_name}")
+
+                    if amounts[currency_id] < order.amount - self.EPSILON:
+                        raise TradeError(f"Недостаточно валюты {order.currency.short_name} для продажи")
+
+                    cash += cost
+                    amounts[currency_id] -= order.amount
+
+            Portfolio.objects.filter(id=portfolio_id).update(balance=cash)
+
+            changed, created, emptied = [], [], []
+
+            for currency_id, amount in amounts.items():
+                balance = balances.get(currency_id)
+
+                if amount < self.EPSILON:
+                    if balance is not None:
+                        emptied.append(balance)
+                elif balance is None:
+                    created.append(CurrencyBalance(portfolio_id=portfolio_id, currency_id=currency_id, amount=amount))
+                elif amount != balance.amount:
+                    balance.amount = amount
+                    changed.append(balance)
+
+            CurrencyBalance.objects.bulk_update(changed, ['amount'])
+            CurrencyBalance.objects.bulk_create(created)
+            CurrencyBalance.objects.filter(id__in=[balance.id for balance in emptied]).delete()
+
+            operations = Operation.objects.bulk_create([
+                Operation(
+                    operation_type=order.operation_type,
+                    portfolio_id=portfolio_id,
+                    currency=order.currency,
+                    amount=order.amount,
+                    price=rates[order.currency.id].cost
+                )
+                for order in orders
+            ])
+
+            valuation = valuations.apply_trade(
+                portfolio_id,
+                changed_holders=[balance.currency_id for balance in created + emptied]
+            )
+
+            PortfolioValue.objects.create(portfolio_id=portfolio_id, value=valuation.total)
+
+        return BatchResult(operations=operations, valuation=valuation)
+
+    def _price(self, currency: Currency, amount: float) -> float:
+        if amount <= 0:
+            raise TradeError("Количество должно быть положительным")
+
+        latest_rate = latest_rates.get(currency.id)
+
+        if latest_rate is None:
+            raise TradeError("Нет доступных курсов для этой валюты")
+
+        return latest_rate.cost
+
+    def _record(self, portfolio_id: int, currency: Currency, operation_type: str,
+                amount: float, price: float, holder_changed: bool) -> TradeResult:
+        operation = Operation.objects.create(
+            operation_type=operation_type,
+            portfolio_id=portfolio_id,
+            currency=currency,
+            amount=amount,
+            price=price
+        )
+
+        # Оценка после сделки собирается под блокировкой строки портфеля
+        valuation = valuations.apply_trade(portfolio_id, changed_holders=[currency.id] if holder_changed else [])
+
+        PortfolioValue.objects.create(portfolio_id=portfolio_id, value=valuation.total)
+
+        return TradeResult(operation=operation, valuation=valuation)
+
+
+trades = TradeService()
@@ -50,6 +50,9 @@ urlpatterns = [
     path('portfolios/<int:pk>/sell/', PortfolioViewSet.as_view({
         'post': 'sell'
     }), name='portfolio-sell'),
+    path('portfolios/<int:pk>/orders/', PortfolioViewSet.as_view({
+        'post': 'orders'
+    }), name='portfolio-orders'),
     path('portfolios/<int:pk>/operations/', PortfolioViewSet.as_view({
         'get': 'operations'
     }), name='portfolio-operations'),
@@ -0,0 +1,276 @@
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Set
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import CurrencyBalance, Portfolio
+from .rates import latest_rates
+
+
+@dataclass
+class Holding:
+    """
+    Остаток одной валюты в портфеле.
+
+    Атрибуты:
+        amount (float): Количество валюты.
+        price (float | None): Последний курс валюты. None - курсов нет, остаток не оценивается.
+    """
+    amount: float
+    price: Optional[float] = None
+
+    @property
+    def value(self) -> float:
+        return self.amount * self.price if self.price is not None else 0
+
+
+@dataclass
+class Valuation:
+    """
+    Оценка портфеля: свободные средства и стоимость каждого остатка.
+
+    Атрибуты:
+        portfolio_id (int): Идентификатор портфеля.
+        cash (float): Свободные средства.
+        holdings (dict): Остатки Holding по идентификатору валюты.
+    """
+    portfolio_id: int
+    cash: float
+    holdings: Dict[int, Holding] = field(default_factory=dict)
+
+    @property
+    def holdings_value(self) -> float:
+        return sum(holding.value for holding in self.holdings.values())
+
+    @property
+    def total(self) -> float:
+        return self.cash + self.holdings_value
+
+    def set_holding(self, currency_id: int, amount: float, price: Optional[float]):
+        if abs(amount) < 1e-10:
+            self.holdings.pop(currency_id, None)
+        else:
+            self.holdings[currency_id] = Holding(amount, price)
+
+
+class PortfolioValuationCache:
+    """
+    Кэш оценок портфелей, сбрасываемый по изменениям.
+
+    Оценки не обновляются на месте приращениями сделок и курсов: в общем кэше
+    чтение и запись значения не атомарны, и параллельные сделки и курсы теряли бы
+    изменения друг друга. Вместо этого сделка сбрасывает оценку своего портфеля
+    (apply_trade), а новый курс - оценки всех портфелей с этой валютой, которые
+    находятся через обратный индекс валюта -> портфели (apply_rates). Промахи
+    собираются из базы пакетно.
+
+    Вместе со сбросом меняется версия оценки. Собранная при промахе оценка
+    сохраняется, только если версия не изменилась за время сборки, поэтому чтение,
+    разминувшееся со сбросом, не возвращает в кэш устаревшее значение.
+    """
+
+    KEY_PREFIX = 'valuation'
+    HOLDERS_KEY_PREFIX = 'valuation-holders'
+    VERSION_KEY_PREFIX = 'valuation-version'
+    TIMEOUT = 24 * 3600
+
+    def key(self, portfolio_id: int) -> str:
+        return f'{self.KEY_PREFIX}:{portfolio_id}'
+
+    def holders_key(self, currency_id: int) -> str:
+        return f'{self.HOLDERS_KEY_PREFIX}:{currency_id}'
+
+    def version_key(self, portfolio_id: int) -> str:
+        return f'{self.VERSION_KEY_PREFIX}:{portfolio_id}'
+
+    def get(self, portfolio_id: int) -> Valuation:
+        """
+        Возвращает оценку портфеля из кэша, при промахе собирает её из базы.
+        """
+        return self.get_many([portfolio_id])[portfolio_id]
+
+    def get_many(self, portfolio_ids: Iterable[int], store: bool = True) -> Dict[int, Valuation]:
+        """
+        Возвращает оценки набора портфелей.
+
+        Аргументы:
+            portfolio_ids (iterable): Идентификаторы портфелей.
+            store (bool): Сохранять ли собранные при промахе оценки в кэш.
+
+        Возвращает:
+            dict: Сопоставление идентификатора портфеля с Valuation. Несуществующие портфели отсутствуют.
+        """
+        keys = {self.key(portfolio_id): portfolio_id for portfolio_id in set(portfolio_ids)}
+
+        if not keys:
+            return {}
+
+        cached = cache.get_many(keys.keys())
+        valuations = {keys[key]: valuation for key, valuation in cached.items()}
+
+        missing = [portfolio_id for key, portfolio_id in keys.items() if key not in cached]
+
+        if missing:
+            versions = self._versions(missing)
+            balances = dict(Portfolio.objects.filter(id__in=missing).values_list('id', 'balance'))
+            built = self.build_many(balances)
+
+            if store:
+                # Сброс во время сборки мог прийти после чтения из базы - такие оценки не сохраняются
+                current = self._versions(missing)
+                self.store(valuation for portfolio_id, valuation in built.items()
+                           if versions.get(portfolio_id) == current.get(portfolio_id))
+
+            valuations.update(built)
+
+        return valuations
+
+    def build_many(self, balances: Dict[int, float]) -> Dict[int, Valuation]:
+        """
+        Собирает оценки портфелей из базы одним запросом остатков и одним обращением к кэшу курсов.
+        В кэш оценки не сохраняются, это делает get_many с проверкой версии.
+
+        Аргументы:
+            balances (dict): Свободные средства по идентификатору портфеля.
+
+        Возвращает:
+            dict: Сопоставление идентификатора портфеля с Valuation.
+        """
+        valuations = {
+            portfolio_id: Valuation(portfolio_id=portfolio_id, cash=balance)
+            for portfolio_id, balance in balances.items()
+        }
+
+        if not valuations:
+            return {}
+
+        rows = list(
+            CurrencyBalance.objects
+            .filter(portfolio_id__in=valuations.keys())
+            .values('portfolio_id', 'currency_id')
+            .annotate(total_amount=Sum('amount'))
+            .order_by()
+            .values_list('portfolio_id', 'currency_id', 'total_amount')
+        )
+        rates = latest_rates.get_many(currency_id for _, currency_id, _ in rows)
+
+        for portfolio_id, currency_id, amount in rows:
+            rate = rates.get(currency_id)
+            valuations[portfolio_id].set_holding(currency_id, amount, rate.cost if rate else None)
+
+        return valuations
+
+    def store(self, valuations: Iterable[Valuation]):
+        cache.set_many({self.key(valuation.portfolio_id): valuation for valuation in valuations},
+                       timeout=self.TIMEOUT)
+
+    def apply_trade(self, portfolio_id: int, changed_holders: Iterable[int] = ()) -> Valuation:
+        """
+        Возвращает оценку портфеля после сделки и сбрасывает её в кэше после фиксации.
+
+        Вызывается внутри транзакции сделки после записи остатков. Строка портфеля
+        уже заблокирована сделкой, поэтому оценка, собранная из базы, точна. Кэш не
+        перезаписывается: порядок on_commit параллельных сделок не гарантирован,
+        и запись могла бы вернуть устаревшую оценку. Следующее чтение соберёт её заново.
+
+        Аргументы:
+            portfolio_id (int): Идентификатор портфеля.
+            changed_holders (iterable): Валюты, которые портфель начал или перестал держать.
+
+        Возвращает:
+            Valuation: Оценка портфеля после сделки.
+        """
+        balance = Portfolio.objects.values_list('balance', flat=True).get(id=portfolio_id)
+        valuation = self.build_many({portfolio_id: balance})[portfolio_id]
+
+        # Портфель начал или перестал держать валюту - индекс собирается заново при следующем курсе
+        holders_keys = [self.holders_key(currency_id) for currency_id in set(changed_holders)]
+
+        def invalidate():
+            self.invalidate([portfolio_id])
+            cache.delete_many(holders_keys)
+
+        transaction.on_commit(invalidate)
+
+        return valuation
+
+    def apply_rates(self, currency_ids: Iterable[int]) -> int:
+        """
+        Сбрасывает оценки портфелей, в которых есть валюты с новыми курсами.
+
+        Оценки не переписываются на месте: чтение и запись значения в кэше не атомарны
+        и гонялись бы с параллельными сделками. Сброшенные оценки собираются из базы
+        пакетно при следующем чтении.
+
+        Аргументы:
+            currency_ids (iterable): Идентификаторы валют, по которым пришли курсы.
+
+        Возвращает:
+            int: Количество сброшенных оценок.
+        """
+        portfolio_ids = {
+            portfolio_id
+            for portfolio_ids in self.holders(currency_ids).values() for portfolio_id in portfolio_ids
+        }
+
+        self.invalidate(portfolio_ids)
+
+        return len(portfolio_ids)
+
+    def holders(self, currency_ids: Iterable[int]) -> Dict[int, Set[int]]:
+        """
+        Обратный индекс: портфели, в которых есть остаток каждой из валют.
+        """
+        keys = {self.holders_key(currency_id): currency_id for currency_id in set(currency_ids)}
+
+        if not keys:
+            return {}
+
+        cached = cache.get_many(keys.keys())
+        holders = {keys[key]: portfolio_ids for key, portfolio_ids in cached.items()}
+
+        missing = [currency_id for key, currency_id in keys.items() if key not in cached]
+
+        if missing:
+            loaded = defaultdict(set)
+
+            for currency_id, portfolio_id in (
+                CurrencyBalance.objects
+                .filter(currency_id__in=missing)
+                .values_list('currency_id', 'portfolio_id')
+            ):
+                loaded[currency_id].add(portfolio_id)
+
+            loaded = {currency_id: loaded[currency_id] for currency_id in missing}
+
+            cache.set_many(
+                {self.holders_key(currency_id): portfolio_ids for currency_id, portfolio_ids in loaded.items()},
+                timeout=self.TIMEOUT
+            )
+            holders.update(loaded)
+
+        return holders
+
+    def invalidate(self, portfolio_ids: Iterable[int]):
+        portfolio_ids = list(portfolio_ids)
+
+        if not portfolio_ids:
+            return
+
+        # Версия меняется до удаления, чтобы собираемая параллельно оценка не сохранилась
+        version = uuid.uuid4().hex
+        cache.set_many({self.version_key(portfolio_id): version for portfolio_id in portfolio_ids},
+                       timeout=self.TIMEOUT)
+        cache.delete_many([self.key(portfolio_id) for portfolio_id in portfolio_ids])
+
+    def _versions(self, portfolio_ids: Iterable[int]) -> Dict[int, str]:
+        keys = {self.version_key(portfolio_id): portfolio_id for portfolio_id in portfolio_ids}
+
+        return {keys[key]: version for key, version in cache.get_many(keys.keys()).items()}
+
+
+valuations = PortfolioValuationCache()
@@ -1,6 +1,5 @@
 from django.conf import settings
 from django.contrib.auth import login, logout
-from django.db import transaction
 from django.utils import timezone
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -9,10 +8,12 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_200_OK
 from rest_framework_simplejwt.tokens import RefreshToken
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
 from datetime import timedelta
 import secrets
 
+from .pagination import RateCursorPagination, RateRollupCursorPagination
+from .rates import latest_rates
+from .trading import Order, TradeError, trades
 from .serializers import *
 
 class AuthViewSet(viewsets.GenericViewSet):
@@ -192,12 +193,32 @@ class AccountViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_200_OK)
 
 
-class PortfolioViewSet(viewsets.ModelViewSet):
+class LatestRatesContextMixin:
+    """
+    Передаёт сериализаторам последние курсы всех валют, загруженные одним обращением к кэшу,
+    чтобы вложенные валюты и остатки не запрашивали курсы построчно.
+    """
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['latest_rates'] = latest_rates.get_many(Currency.objects.values_list('id', flat=True))
+
+        return context
+
+
+class PortfolioViewSet(LatestRatesContextMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post']
 
     def get_queryset(self):
-        return Portfolio.objects.filter(account=self.request.user)
+        queryset = Portfolio.objects.filter(account=self.request.user)
+
+        # Сделки меняют остатки, поэтому предзагрузка нужна только для чтения.
+        # Списки портфеля выводят его у каждой строки, счётчики считаются один раз здесь
+        if self.action in ['list', 'retrieve', 'operations', 'watches']:
+            queryset = queryset.with_summary()
+
+        return queryset
 
     def get_object(self):
         obj = super().get_object()
@@ -210,6 +231,8 @@ class PortfolioViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action in ['buy', 'sell']:
             return PortfolioOperationSerializer
+        elif self.action == 'orders':
+            return PortfolioOrdersSerializer
 
         return PortfolioSerializer
 
@@ -224,148 +247,65 @@ class PortfolioViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def buy(self, request, pk=None):
+        return self._trade(trades.buy)
+
+    @action(detail=True, methods=['post'])
+    def sell(self, request, pk=None):
+        return self._trade(trades.sell)
+
+    @action(detail=True, methods=['post'])
+    def orders(self, request, pk=None):
         portfolio = self.get_object()
-        serializer = PortfolioOperationSerializer(data=request.data)
+        serializer = PortfolioOrdersSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        
-        currency = serializer.validated_data['currency']
-        amount = serializer.validated_data['amount']
-        
+
         try:
-            current_rate = currency.rate_set.latest('timestamp')
-            price = current_rate.cost
-        except Rate.DoesNotExist:
-            return Response(
-                {"error": "Нет доступных курсов для этой валюты"},
-                status=status.HTTP_400_BAD_REQUEST
+            result = trades.execute(
+                portfolio.id,
+                [Order(**order) for order in serializer.validated_data['orders']]
             )
-        
-        total_cost = amount * price
-        
-        if portfolio.balance < total_cost:
+        except TradeError as e:
             return Response(
-                {"error": "Недостаточно средств на балансе"},
+                {"error": str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        with transaction.atomic():
-            operation = Operation.objects.create(
-                operation_type='buy',
-                portfolio=portfolio,
-                currency=currency,
-                amount=amount,
-                price=price
-            )
-            
-            portfolio.balance -= total_cost
-            portfolio.save()
-            
-            currency_balance, created = CurrencyBalance.objects.get_or_create(
-                portfolio=portfolio,
-                currency=currency,
-                defaults={'amount': amount}
-            )
-            
-            if not created:
-                currency_balance.amount += amount
-                currency_balance.save()
-            
-            portfolio.operations.add(operation)
-
-            total_value = portfolio.balance
-            for balance in CurrencyBalance.objects.filter(portfolio=portfolio).select_related('currency'):
-                try:
-                    current_rate = balance.currency.rate_set.latest('timestamp')
-                    total_value += balance.amount * current_rate.cost
-                except Rate.DoesNotExist:
-                    continue
-            
-            PortfolioValue.objects.create(
-                portfolio=portfolio,
-                value=total_value
-            )
-        
-        return Response(OperationSerializer(operation).data, status=status.HTTP_201_CREATED)
 
-    @action(detail=True, methods=['post'])
-    def sell(self, request, pk=None):
+        operations = Operation.objects.filter(
+            id__in=[operation.id for operation in result.operations]
+        ).order_by('id').with_portfolio_summary()
+
+        return Response({
+            'operations': OperationSerializer(operations, many=True, context=self.get_serializer_context()).data,
+            'total_value': result.valuation.total
+        }, status=status.HTTP_201_CREATED)
+
+    def _trade(self, execute):
         portfolio = self.get_object()
-        serializer = PortfolioOperationSerializer(data=request.data)
+        serializer = PortfolioOperationSerializer(data=self.request.data)
         serializer.is_valid(raise_exception=True)
-        
-        currency = serializer.validated_data['currency']
-        amount = serializer.validated_data['amount']
-        
-        try:
-            current_rate = currency.rate_set.latest('timestamp')
-            price = current_rate.cost
-        except Rate.DoesNotExist:
-            return Response(
-                {"error": "Нет доступных курсов для этой валюты"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+
         try:
-            currency_balance = CurrencyBalance.objects.get(
-                portfolio=portfolio,
-                currency=currency
-            )
-        except CurrencyBalance.DoesNotExist:
-            return Response(
-                {"error": "У вас нет этой валюты"},
-                status=status.HTTP_400_BAD_REQUEST
+            result = execute(
+                portfolio.id,
+                serializer.validated_data['currency'],
+                serializer.validated_data['amount']
             )
-        
-        if currency_balance.amount < amount:
+        except TradeError as e:
             return Response(
-                {"error": "Недостаточно валюты для продажи"},
+                {"error": str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        total_value = amount * price
-        
-        with transaction.atomic():
-            operation = Operation.objects.create(
-                operation_type='sell',
-                portfolio=portfolio,
-                currency=currency,
-                amount=amount,
-                price=price
-            )
-            
-            portfolio.balance += total_value
-            portfolio.save()
-            
-            currency_balance.amount -= amount
-            if abs(currency_balance.amount) < 1e-10:  # Проверка на близость к нулю
-                currency_balance.delete()
-            else:
-                currency_balance.save()
-            
-            portfolio.operations.add(operation)
-
-            total_value = portfolio.balance
-            for balance in CurrencyBalance.objects.filter(portfolio=portfolio).select_related('currency'):
-                try:
-                    current_rate = balance.currency.rate_set.latest('timestamp')
-                    total_value += balance.amount * current_rate.cost
-                except Rate.DoesNotExist:
-                    continue
-            
-            PortfolioValue.objects.create(
-                portfolio=portfolio,
-                value=total_value
-            )
-        
-        return Response(OperationSerializer(operation).data, status=status.HTTP_201_CREATED)
+
+        return Response(OperationSerializer(result.operation).data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['get'])
     def operations(self, request, pk=None):
         portfolio = self.get_object()
 
-        operations = portfolio.operations.all()
+        # Связанный менеджер подставляет в строки уже загруженный портфель со счётчиками
+        operations = portfolio.operation_set.select_related('currency')
 
-        serializer = OperationSerializer(operations, many=True)
+        serializer = OperationSerializer(operations, many=True, context=self.get_serializer_context())
 
         return Response(serializer.data)
 
@@ -373,9 +313,9 @@ class PortfolioViewSet(viewsets.ModelViewSet):
     def watches(self, request, pk=None):
         portfolio = self.get_object()
 
-        watches = portfolio.watches.all()
+        watches = portfolio.watch_set.select_related('currency')
 
-        serializer = WatchSerializer(watches, many=True)
+        serializer = WatchSerializer(watches, many=True, context=self.get_serializer_context())
 
         return Response(serializer.data)
 
@@ -385,17 +325,17 @@ class PortfolioViewSet(viewsets.ModelViewSet):
 
         currency_balances = CurrencyBalance.objects.filter(portfolio=portfolio).select_related('currency')
 
-        serializer = CurrencyBalanceSerializer(currency_balances, many=True)
+        serializer = CurrencyBalanceSerializer(currency_balances, many=True, context=self.get_serializer_context())
 
         return Response(serializer.data)
 
 
-class OperationViewSet(viewsets.ModelViewSet):
+class OperationViewSet(LatestRatesContextMixin, viewsets.ModelViewSet):
     serializer_class = OperationSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Operation.objects.filter(portfolio__account=self.request.user)
+        return Operation.objects.filter(portfolio__account=self.request.user).with_portfolio_summary()
 
     def get_object(self):
         obj = super().get_object()
@@ -414,7 +354,54 @@ class OperationViewSet(viewsets.ModelViewSet):
         serializer.save()
 
 
-class CurrencyViewSet(viewsets.ReadOnlyModelViewSet):
+class RateListMixin:
+    """
+    Постраничная выдача курсов с выбором полей и плоским режимом.
+    """
+
+    def list_rates(self, request, rates, params):
+        """
+        Аргументы:
+            request (Request): Запрос.
+            rates (QuerySet): Курсы без сортировки, её задаёт пагинация.
+            params (dict): Проверенные параметры RateQuerySerializer.
+
+        Возвращает:
+            Response: Страница курсов со ссылками next/previous.
+        """
+        if params.get('date_from'):
+            rates = rates.filter(timestamp__gte=params['date_from'])
+        if params.get('date_to'):
+            rates = rates.filter(timestamp__lte=params['date_to'])
+
+        projection = params.get('projection')
+        flat = params['flat']
+        nested = not flat and (projection is None or 'currency' in projection)
+
+        # id и timestamp нужны пагинации для построения курсора
+        columns = {'id', 'timestamp', 'currency'}
+
+        if projection is None or 'cost' in projection:
+            columns.add('cost')
+        if nested:
+            rates = rates.select_related('currency')
+            columns.update(f'currency__{field}' for field in ('name', 'short_name', 'description'))
+
+        paginator = RateCursorPagination()
+        page = paginator.paginate_queryset(rates.only(*columns), request, view=self)
+
+        context = self.get_serializer_context()
+
+        if nested:
+            context['latest_rates'] = latest_rates.get_many({rate.currency_id for rate in page})
+
+        serializer_class = RateFlatSerializer if flat else RateSerializer
+        serializer = serializer_class(page, many=True, fields=projection, context=context)
+
+        return paginator.get_paginated_response(serializer.data)
+
+
+class CurrencyViewSet(RateListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Currency.objects.all()
     serializer_class = CurrencySerializer
     permission_classes = [IsAuthenticated]
@@ -423,19 +410,37 @@ class CurrencyViewSet(viewsets.ReadOnlyModelViewSet):
     def rates(self, request, pk=None):
         currency = self.get_object()
 
-        rates = currency.rate_set.order_by('-timestamp')
+        params = RateRangeSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
 
-        serializer = RateSerializer(rates, many=True)
+        resolution = params.validated_data['resolution']
+        date_from = params.validated_data.get('date_from')
+        date_to = params.validated_data.get('date_to')
 
-        return Response(serializer.data)
+        if resolution == 'raw':
+            return self.list_rates(request, currency.rate_set.all(), params.validated_data)
+
+        rollups = RateRollup.objects.filter(currency=currency, resolution=resolution.upper())
+
+        if date_from:
+            rollups = rollups.filter(bucket__gte=date_from)
+        if date_to:
+            rollups = rollups.filter(bucket__lte=date_to)
+
+        paginator = RateRollupCursorPagination()
+        page = paginator.paginate_queryset(rollups, request, view=self)
+        serializer = RateRollupSerializer(page, many=True, fields=params.validated_data.get('projection'))
+
+        return paginator.get_paginated_response(serializer.data)
 
 
-class RateViewSet(viewsets.ReadOnlyModelViewSet):
+class RateViewSet(RateListMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = RateSerializer
+    pagination_class = RateCursorPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        queryset = Rate.objects.select_related('currency').order_by('-timestamp')
+        queryset = Rate.objects.all()
 
         short_name = self.request.query_params.get('short_name')
 
@@ -444,13 +449,19 @@ class RateViewSet(viewsets.ReadOnlyModelViewSet):
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        params = RateQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
 
-class WatchViewSet(viewsets.ModelViewSet):
+        return self.list_rates(request, self.filter_queryset(self.get_queryset()), params.validated_data)
+
+
+class WatchViewSet(LatestRatesContextMixin, viewsets.ModelViewSet):
     serializer_class = WatchSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Watch.objects.filter(portfolio__account=self.request.user)
+        return Watch.objects.filter(portfolio__account=self.request.user).with_portfolio_summary()
 
     def get_object(self):
         obj = super().get_object()
@@ -466,50 +477,4 @@ class WatchViewSet(viewsets.ModelViewSet):
         if portfolio.account != self.request.user:
             raise PermissionDenied("Вы не можете добавлять отслеживаемые валюты в чужой портфель")
         
-        watch = serializer.save()
-        portfolio.watches.add(watch)
-        
-        schedule, _ = CrontabSchedule.objects.get_or_create(
-            hour=watch.notify_time.hour,
-            minute=watch.notify_time.minute,
-            day_of_week='*',
-            day_of_month='*',
-            month_of_year='*',
-        )
-
-        PeriodicTask.objects.create(
-            name=f'notify-{watch.id}',
-            task='api.tasks.notify_currency_rate',
-            crontab=schedule,
-            args=[watch.id],
-            enabled=True
-        )
-
-    def perform_update(self, serializer):
-        watch = serializer.save()
-        
-        schedule, _ = CrontabSchedule.objects.get_or_create(
-            hour=watch.notify_time.hour,
-            minute=watch.notify_time.minute,
-            day_of_week='*',
-            day_of_month='*',
-            month_of_year='*',
-        )
-
-        task, created = PeriodicTask.objects.get_or_create(
-            name=f'notify-{watch.id}',
-            defaults={
-                'task': 'api.tasks.notify_currency_rate',
-                'args': [watch.id],
-                'enabled': True
-            }
-        )
-        
-        if not created:
-            task.crontab = schedule
-            task.save()
-
-    def perform_destroy(self, instance):
-        PeriodicTask.objects.filter(name=f'notify-{instance.id}').delete()
-
-        instance.delete()
+        serializer.save()
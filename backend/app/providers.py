@@ -0,0 +1,426 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import asyncio
+import json
+import xml.etree.ElementTree as ET
+
+import aiohttp
+from django.conf import settings
+from django.utils import timezone as django_timezone
+
+
+@dataclass
+class CurrencyRate:
+    """
+    Представляет курс валюты с сопутствующими метаданными.
+
+    Атрибуты:
+        currency (str): Название валюты.
+        code (str): Краткий код валюты.
+        price (float): Курс обмена.
+        date (datetime): Дата курса обмена.
+    """
+    currency: str
+    code: str
+    price: float
+    date: datetime
+
+
+# Приёмник курсов: получает их пакетами по мере разбора ответов
+RateSink = Callable[[List[CurrencyRate]], Awaitable[None]]
+
+
+class RateProvider:
+    """
+    Базовый класс источника курсов.
+
+    Атрибуты:
+        name (str): Уникальное имя источника.
+        currencies (dict): Сопоставление кодов валют с их идентификаторами у источника.
+        quote (str): Валюта, в которой источник возвращает цены. Цены не в рублях
+                     конвертируются через курс этой валюты.
+        cadence (timedelta): Минимальный интервал между загрузками.
+        batch_size (int): Сколько валют источник отдаёт за один запрос.
+    """
+
+    name = None
+    currencies: Dict[str, str] = {}
+    quote = 'RUB'
+    cadence = timedelta(minutes=5)
+    batch_size = 1
+
+    RETRIES = 3
+    RETRY_BACKOFF = 0.5
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    async def fetch(self, session: aiohttp.ClientSession, windows: Dict[str, datetime],
+                    end_date: datetime, sink: RateSink):
+        """
+        Загружает курсы для указанных валют и передаёт их в sink по мере получения.
+
+        Курсы целиком в памяти не собираются: каждый разобранный фрагмент ответа
+        сразу уходит в sink. При повторе запроса часть курсов может прийти повторно.
+
+        Аргументы:
+            session (aiohttp.ClientSession): Общая сессия с пулом соединений.
+            windows (dict): Начальная дата окна для каждого кода валюты.
+            end_date (datetime): Конечная дата для получения курсов.
+            sink (callable): Приёмник курсов в валюте quote.
+
+        Если хотя бы один запрос не удался, после завершения остальных поднимается
+        исключение: загрузка считается неполной и повторяется при следующем запуске.
+        """
+        raise NotImplementedError
+
+    async def request(self, session: aiohttp.ClientSession, url: str, params: Dict[str, Any]) -> bytes:
+        """
+        Выполняет GET-запрос с повторами и экспоненциальной задержкой.
+
+        Аргументы:
+            session (aiohttp.ClientSession): Общая сессия.
+            url (str): Адрес запроса.
+            params (dict): Параметры запроса.
+
+        Возвращает:
+            bytes: Тело ответа.
+        """
+        for attempt in range(self.RETRIES):
+            try:
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    return await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.RETRIES - 1:
+                    raise
+
+                await asyncio.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+
+    async def request_xml(self, session: aiohttp.ClientSession, url: str, params: Dict[str, Any],
+                          handler: Callable[[], Callable[[Iterator[Tuple[str, ET.Element]]], Iterator[CurrencyRate]]],
+                          sink: RateSink):
+        """
+        Выполняет GET-запрос и разбирает XML потоково по мере получения байтов ответа.
+
+        Дерево документа целиком не строится: обработчик получает события XMLPullParser
+        и должен очищать обработанные элементы, а курсы каждого фрагмента ответа
+        сразу передаются в sink. При ошибке запрос повторяется с экспоненциальной
+        задержкой и новым обработчиком; уже переданные курсы придут повторно,
+        поэтому запись в sink должна быть идемпотентной.
+
+        Аргументы:
+            session (aiohttp.ClientSession): Общая сессия.
+            url (str): Адрес запроса.
+            params (dict): Параметры запроса.
+            handler (callable): Фабрика обработчика, превращающего события парсера в объекты CurrencyRate.
+            sink (callable): Приёмник курсов.
+        """
+        for attempt in range(self.RETRIES):
+            try:
+                parser = ET.XMLPullParser(events=('start', 'end'))
+                handle = handler()
+
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+
+                    async for chunk in response.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                        parser.feed(chunk)
+                        await self._drain(handle(parser.read_events()), sink)
+
+                parser.close()
+                await self._drain(handle(parser.read_events()), sink)
+
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.RETRIES - 1:
+                    raise
+
+                await asyncio.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+
+    async def gather(self, *requests: Awaitable):
+        """
+        Дожидается всех запросов и, если какие-то завершились ошибкой, поднимает первую.
+
+        Успешные запросы не прерываются соседними ошибками: их курсы уже переданы
+        в приёмник, а ошибка сообщает вызывающему, что загрузка неполная.
+        """
+        results = await asyncio.gather(*requests, return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _drain(self, rates: Iterator[CurrencyRate], sink: RateSink):
+        rates = list(rates)
+
+        if rates:
+            await sink(rates)
+
+
+@lru_cache(maxsize=4096)
+def parse_cbr_date(date_str: str) -> datetime:
+    """
+    Переводит дату ЦБ РФ вида ДД.ММ.ГГГГ в datetime с часовым поясом.
+
+    Результат кэшируется: одна и та же дата встречается в ответах по всем валютам.
+    """
+    return django_timezone.make_aware(datetime.strptime(date_str, '%d.%m.%Y'))
+
+
+def parse_cbr_value(value_str: str) -> float:
+    return float(value_str.replace(',', '.'))
+
+
+class CBRProvider(RateProvider):
+    """
+    Курсы фиатных валют ЦБ РФ.
+
+    Короткие окна загружаются пакетно через XML_daily: один запрос на день
+    отдаёт курсы всех валют. Длинные окна загружаются через XML_dynamic
+    одним запросом на валюту.
+    """
+
+    name = 'cbr'
+    currencies = {
+        'USD': 'R01235',
+        'EUR': 'R01239',
+        'CNY': 'R01375',
+        'AED': 'R01230'
+    }
+    cadence = timedelta(hours=1)
+    batch_size = len(currencies)
+
+    DYNAMIC_URL = 'https://www.cbr.ru/scripts/XML_dynamic.asp'
+    DAILY_URL = 'https://www.cbr.ru/scripts/XML_daily.asp'
+
+    # Максимальная длина окна в днях, при которой выгоднее пакетная загрузка по дням
+    BATCH_WINDOW_DAYS = 7
+
+    async def fetch(self, session, windows, end_date, sink):
+        start_date = min(windows.values())
+        days = (end_date.date() - start_date.date()).days + 1
+
+        if len(windows) > 1 and days <= min(self.BATCH_WINDOW_DAYS, len(windows)):
+            await self._fetch_daily(session, windows, end_date, sink)
+            return
+
+        await self.gather(*[
+            self._fetch_dynamic(session, code, currency_start, end_date, sink)
+            for code, currency_start in windows.items()
+        ])
+
+    async def _fetch_dynamic(self, session: aiohttp.ClientSession, code: str,
+                             start_date: datetime, end_date: datetime, sink: RateSink):
+        try:
+            await self.request_xml(session, self.DYNAMIC_URL, {
+                'date_req1': start_date.strftime('%d/%m/%Y'),
+                'date_req2': end_date.strftime('%d/%m/%Y'),
+                'VAL_NM_RQ': self.currencies[code]
+            }, partial(DynamicHandler, code), sink)
+        except Exception as e:
+            print(f"Ошибка при получении курсов ЦБ РФ для {code}: {e}")
+            raise
+
+    async def _fetch_daily(self, session: aiohttp.ClientSession, windows: Dict[str, datetime],
+                           end_date: datetime, sink: RateSink):
+        start_date = min(windows.values())
+        days = [start_date.date() + timedelta(days=offset)
+                for offset in range((end_date.date() - start_date.date()).days + 1)]
+
+        async def window_sink(rates):
+            # На выходные ЦБ РФ возвращает последний установленный курс; дубли схлопывает приёмник
+            rates = [rate for rate in rates if rate.date >= windows[rate.code]]
+
+            if rates:
+                await sink(rates)
+
+        async def fetch_day(day):
+            try:
+                await self.request_xml(session, self.DAILY_URL, {
+                    'date_req': day.strftime('%d/%m/%Y')
+                }, partial(DailyHandler, windows.keys()), window_sink)
+            except Exception as e:
+                print(f"Ошибка при получении курсов ЦБ РФ за {day}: {e}")
+                raise
+
+        await self.gather(*[fetch_day(day) for day in days])
+
+
+class DynamicHandler:
+    """
+    Потоковый разбор ответа XML_dynamic: элементы Record одной валюты.
+    """
+
+    def __init__(self, code: str):
+        self.code = code
+        self.root = None
+
+    def __call__(self, events: Iterator[Tuple[str, ET.Element]]) -> Iterator[CurrencyRate]:
+        for event, element in events:
+            if event == 'start':
+                if self.root is None:
+                    self.root = element
+            elif element.tag == 'Record':
+                yield CurrencyRate(
+                    currency=self.code,
+                    code=self.code,
+                    price=parse_cbr_value(element.findtext('Value')),
+                    date=parse_cbr_date(element.get('Date'))
+                )
+
+                self.root.clear()
+
+
+class DailyHandler:
+    """
+    Потоковый разбор ответа XML_daily: элементы Valute всех валют за один день.
+    """
+
+    def __init__(self, codes: Iterable[str]):
+        self.codes = set(codes)
+        self.root = None
+        self.date = None
+
+    def __call__(self, events: Iterator[Tuple[str, ET.Element]]) -> Iterator[CurrencyRate]:
+        for event, element in events:
+            if event == 'start':
+                if self.root is None:
+                    self.root = element
+                    self.date = parse_cbr_date(element.get('Date'))
+            elif element.tag == 'Valute':
+                code = element.findtext('CharCode')
+
+                if code in self.codes:
+                    yield CurrencyRate(
+                        currency=code,
+                        code=code,
+                        price=parse_cbr_value(element.findtext('Value')),
+                        date=self.date
+                    )
+
+                self.root.clear()
+
+
+class BinanceProvider(RateProvider):
+    """
+    Курсы криптовалют Binance в долларах (пары к USDT) по цене закрытия свечей.
+
+    Диапазон разбивается на страницы по KLINES_LIMIT свечей, и все страницы
+    запрашиваются одновременно, поэтому длинные диапазоны не обрезаются.
+    Поддерживаются дневные и внутридневные интервалы (1h, 5m и т.д.).
+    """
+
+    name = 'binance'
+    currencies = {
+        'BTC': 'BTCUSDT',
+        'ETH': 'ETHUSDT'
+    }
+    quote = 'USD'
+    cadence = timedelta(minutes=5)
+
+    KLINES_URL = 'https://api.binance.com/api/v3/klines'
+    KLINES_LIMIT = 1000
+
+    INTERVALS = {
+        '1m': timedelta(minutes=1),
+        '5m': timedelta(minutes=5),
+        '15m': timedelta(minutes=15),
+        '30m': timedelta(minutes=30),
+        '1h': timedelta(hours=1),
+        '4h': timedelta(hours=4),
+        '1d': timedelta(days=1),
+    }
+
+    def __init__(self, interval: str = '1d'):
+        if interval not in self.INTERVALS:
+            raise ValueError(f'Неподдерживаемый интервал свечей Binance: {interval}')
+
+        self.interval = interval
+
+    async def fetch(self, session, windows, end_date, sink):
+        await self.gather(*[
+            self._fetch_klines(session, symbol, symbol_start, end_date, sink)
+            for symbol, symbol_start in windows.items()
+        ])
+
+    def pages(self, start_date: datetime, end_date: datetime) -> List[Tuple[int, int]]:
+        """
+        Разбивает диапазон на страницы, каждая из которых умещается в один запрос.
+
+        Возвращает:
+            list: Пары (startTime, endTime) в миллисекундах.
+        """
+        start_ms = int(start_date.timestamp() * 1000)
+        end_ms = int(end_date.timestamp() * 1000)
+        page_ms = int(self.INTERVALS[self.interval].total_seconds() * 1000) * self.KLINES_LIMIT
+
+        return [(page_start, min(page_start + page_ms - 1, end_ms)) for page_start in range(start_ms, end_ms + 1, page_ms)]
+
+    async def _fetch_klines(self, session: aiohttp.ClientSession, symbol: str,
+                            start_date: datetime, end_date: datetime, sink: RateSink):
+        async def fetch_page(page_start, page_end):
+            content = await self.request(session, self.KLINES_URL, {
+                'symbol': self.currencies[symbol],
+                'interval': self.interval,
+                'startTime': page_start,
+                'endTime': page_end,
+                'limit': self.KLINES_LIMIT
+            })
+
+            await self._drain((
+                CurrencyRate(
+                    currency=symbol,
+                    code=symbol,
+                    price=float(kline[4]),
+                    date=django_timezone.localtime(datetime.fromtimestamp(kline[0] // 1000, tz=timezone.utc))
+                )
+                for kline in json.loads(content)
+            ), sink)
+
+        try:
+            await self.gather(*[
+                fetch_page(page_start, page_end) for page_start, page_end in self.pages(start_date, end_date)
+            ])
+        except Exception as e:
+            print(f"Ошибка при получении курсов Binance для {symbol}: {e}")
+            raise
+
+
+class ProviderRegistry:
+    """
+    Реестр источников курсов.
+    """
+
+    def __init__(self):
+        self._providers: Dict[str, RateProvider] = {}
+
+    def register(self, provider: RateProvider) -> RateProvider:
+        for code in provider.currencies:
+            owner = self.provider_for(code)
+
+            if owner is not None:
+                raise ValueError(f'Валюта {code} уже обслуживается источником {owner.name}')
+
+        self._providers[provider.name] = provider
+
+        return provider
+
+    @property
+    def providers(self) -> List[RateProvider]:
+        return list(self._providers.values())
+
+    def codes(self) -> List[str]:
+        return [code for provider in self._providers.values() for code in provider.currencies]
+
+    def provider_for(self, code: str) -> Optional[RateProvider]:
+        for provider in self._providers.values():
+            if code in provider.currencies:
+                return provider
+
+        return None
+
+
+registry = ProviderRegistry()
+registry.register(CBRProvider())
+registry.register(BinanceProvider(settings.BINANCE_KLINE_INTERVAL))
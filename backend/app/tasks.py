@@ -1,200 +1,385 @@
 from celery import shared_task
-from datetime import datetime, timedelta, timezone
-import requests
-import xml.etree.ElementTree as ET
+from collections import defaultdict
+from datetime import datetime, timedelta
+import asyncio
+import aiohttp
+from asgiref.sync import sync_to_async
 from api.models import Currency, Rate
-from django.db import transaction
-from typing import List, Dict, Any
-from dataclasses import dataclass
+from django.db import close_old_connections, connection, transaction
+from typing import List, Dict, Iterable, Tuple
 from django.utils import timezone as django_timezone
 from django.core.cache import cache
-
-@dataclass
-class CurrencyRate:
-    """
-    Представляет курс валюты с сопутствующими метаданными.
-
-    Атрибуты:
-        currency (str): Название валюты.
-        code (str): Краткий код валюты.
-        price (float): Курс обмена.
-        date (datetime): Дата курса обмена.
-    """
-    currency: str
-    code: str
-    price: float
-    date: datetime
+from api.rates import latest_rates
+from api.rollups import rate_rollups
+from api.valuation import valuations
+from .providers import CurrencyRate, ProviderRegistry, RateProvider, registry
 
 class CurrencyRatesService:
     """
     Сервис для получения и обработки курсов валют из внешних API.
 
-    Атрибуты:
-        CBR_CODES (dict): Сопоставление кодов валют с их идентификаторами для ЦБ РФ.
-        BINANCE_PAIRS (dict): Сопоставление символов криптовалют с их торговыми парами Binance.
+    Источники курсов берутся из реестра провайдеров (app.providers.registry):
+    каждый провайдер сам объявляет обслуживаемые валюты, периодичность загрузки
+    и валюту котировки. Все провайдеры опрашиваются одновременно.
     """
 
-    CBR_CODES = {
-        "USD": "R01235",
-        "EUR": "R01239",
-        "CNY": "R01375",
-        "AED": "R01230"
+    # Глубина полной загрузки для валют без сохранённых курсов
+    BACKFILL_PERIOD = timedelta(days=365)
+    # Перекрытие с последним сохранённым курсом для учёта поздних исправлений
+    OVERLAP = timedelta(days=2)
+    # Размер пакета при сохранении курсов
+    BATCH_SIZE = 1000
+    # Запас окна валюты котировки, чтобы первым точкам было с чем соединиться (выходные, праздники)
+    QUOTE_LOOKBACK = timedelta(days=7)
+
+    # Параметры асинхронной загрузки
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
     }
+    MAX_CONNECTIONS_PER_HOST = 4
+    REQUEST_TIMEOUT = 10
+    DEADLINE = 30
 
-    BINANCE_PAIRS = {
-        'BTC': 'BTCUSDT',
-        'ETH': 'ETHUSDT'
-    }
+    LAST_RUN_KEY = 'rates-provider:{name}:last-run'
+    # Допуск на неточность расписания Celery Beat при проверке периодичности
+    CADENCE_TOLERANCE = timedelta(seconds=30)
+
+    def __init__(self, providers: ProviderRegistry = registry, concurrent: bool = True):
+        """
+        Инициализирует CurrencyRatesService.
+
+        Аргументы:
+            providers (ProviderRegistry): Реестр источников курсов.
+            concurrent (bool): Опрашивать источники одновременно. При False источники
+                               опрашиваются последовательно.
+        """
+        self.providers = providers
+        self.concurrent = concurrent
 
-    def __init__(self):
+    def get_start_dates(self, latest_timestamps: Dict[str, datetime], end_date: datetime) -> Dict[str, datetime]:
         """
-        Инициализирует CurrencyRatesService с сессией запросов.
+        Вычисляет начало окна загрузки для каждой валюты.
+
+        Аргументы:
+            latest_timestamps (dict): Последний сохранённый временной штамп по коду валюты (или None).
+            end_date (datetime): Конечная дата для получения курсов.
+
+        Возвращает:
+            dict: Начальная дата окна для каждой валюты: последний курс минус перекрытие
+                  или полная загрузка за BACKFILL_PERIOD, если курсов ещё нет.
         """
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        return {
+            code: latest - self.OVERLAP if latest else end_date - self.BACKFILL_PERIOD
+            for code, latest in latest_timestamps.items()
+        }
 
-    def __del__(self):
+    def due_providers(self, now: datetime) -> List[RateProvider]:
         """
-        Закрывает сессию запросов при удалении сервиса.
+        Возвращает провайдеров, для которых истёк интервал cadence с прошлой загрузки.
         """
-        if hasattr(self, 'session'):
-            self.session.close()
+        keys = {provider: self.LAST_RUN_KEY.format(name=provider.name) for provider in self.providers.providers}
+        last_runs = cache.get_many(keys.values())
+
+        return [
+            provider for provider, key in keys.items()
+            if key not in last_runs or now - last_runs[key] >= provider.cadence - self.CADENCE_TOLERANCE
+        ]
 
-    def get_rates(self, start_date: datetime, end_date: datetime) -> Dict[str, List[CurrencyRate]]:
+    def mark_run(self, providers: List[RateProvider], now: datetime):
+        cache.set_many({self.LAST_RUN_KEY.format(name=provider.name): now for provider in providers}, timeout=None)
+
+    def load_rates(self, currencies: Dict[str, Currency], start_dates: Dict[str, datetime],
+                   end_date: datetime, providers: List[RateProvider]) -> Tuple['RateWriter', List[RateProvider]]:
         """
-        Получает курсы валют от ЦБ РФ и Binance.
+        Загружает курсы от провайдеров и записывает их пакетами по мере получения.
+
+        Границы транзакций: каждый пакет фиксируется отдельно в режиме автофиксации,
+        поэтому вызывать load_rates внутри transaction.atomic нельзя - пакеты из цикла
+        событий пишутся через соединение потока sync_to_async и транзакцию вызывающего
+        не увидят. К возврату все пакеты уже зафиксированы, и последующие транзакции
+        вызывающего (агрегаты, on_commit) видят их из своего соединения.
 
         Аргументы:
-            start_date (datetime): Начальная дата для получения курсов.
+            currencies (dict): Валюты по коду, курсы которых сохраняются.
+            start_dates (dict): Начальная дата окна для каждой валюты.
             end_date (datetime): Конечная дата для получения курсов.
+            providers (list): Опрашиваемые провайдеры.
 
         Возвращает:
-            dict: Словарь, содержащий списки объектов CurrencyRate для каждой валюты.
+            tuple: Записавший курсы RateWriter со сведениями об обновлённых валютах
+                   и провайдеры, загрузка которых завершилась без ошибок.
         """
-        try:
-            rates = {}
+        plan = self._plan_windows(providers, start_dates)
+        writer = RateWriter(currencies, self.BATCH_SIZE,
+                            retain={provider.quote for provider in plan if provider.quote != 'RUB'})
 
-            # Получение курсов фиатных валют от ЦБ РФ
-            for currency_code in self.CBR_CODES:
-                rates[currency_code] = self._get_cbr_rates(currency_code, start_date, end_date)
+        quoted = defaultdict(list)
+        succeeded = asyncio.run(self._fetch_all(plan, end_date, writer, quoted))
 
-            # Получение курсов криптовалют от Binance и конвертация через USD/RUB
-            usd_rates = rates.get('USD', [])
-            if usd_rates:
-                usd_rub_rates = {rate.date.strftime('%Y-%m-%d'): rate.price for rate in usd_rates}
-                for symbol in self.BINANCE_PAIRS:
-                    klines = self._get_binance_rates(symbol, start_date, end_date)
-                    if klines and usd_rub_rates:
-                        rates[symbol] = self._convert_crypto_rates(symbol, klines, usd_rub_rates)
+        self._write_converted(plan, start_dates, quoted, writer, succeeded)
+        writer.flush()
 
-            return rates
-        except Exception as e:
-            print(f"Ошибка при получении курсов: {e}")
-            return {}
+        # Провайдер не в рублях загружен, только если удалось загрузить и его котировку
+        return writer, [
+            provider for provider in succeeded
+            if provider.quote == 'RUB' or self.providers.provider_for(provider.quote) in succeeded
+        ]
 
-    def _get_cbr_rates(self, currency_code: str, start_date: datetime, end_date: datetime) -> List[CurrencyRate]:
+    def _plan_windows(self, providers: List[RateProvider],
+                      start_dates: Dict[str, datetime]) -> Dict[RateProvider, Dict[str, datetime]]:
         """
-        Получает курсы валют от ЦБ РФ.
+        Распределяет окна загрузки по провайдерам.
+
+        Для провайдеров с котировкой не в рублях окно валюты котировки расширяется
+        до самого раннего окна их валют с запасом QUOTE_LOOKBACK, чтобы было по чему конвертировать.
 
         Аргументы:
-            currency_code (str): Код валюты для получения курсов.
-            start_date (datetime): Начальная дата для получения курсов.
-            end_date (datetime): Конечная дата для получения курсов.
+            providers (list): Опрашиваемые провайдеры.
+            start_dates (dict): Начальная дата для каждой валюты.
 
         Возвращает:
-            list: Список объектов CurrencyRate.
+            dict: Окна загрузки по кодам валют для каждого провайдера.
         """
-        try:
-            formatted_start = start_date.strftime('%d/%m/%Y')
-            formatted_end = end_date.strftime('%d/%m/%Y')
-            url = f"https://www.cbr.ru/scripts/XML_dynamic.asp?date_req1={formatted_start}&date_req2={formatted_end}&VAL_NM_RQ={self.CBR_CODES[currency_code]}"
-
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-
-            root = ET.fromstring(response.text)
-            rates = []
-
-            for record in root.findall('.//Record'):
-                date_str = record.get('Date')
-                date = django_timezone.make_aware(datetime.strptime(date_str, '%d.%m.%Y'))
-                value_str = record.find('Value').text.replace(',', '.')
-                value = float(value_str)
-
-                rate = CurrencyRate(
-                    currency=currency_code,
-                    code=currency_code,
-                    price=value,
-                    date=date
-                )
-                rates.append(rate)
-
-            return rates
-        except Exception as e:
-            print(f"Ошибка при получении курсов ЦБ РФ для {currency_code}: {e}")
-            return []
+        plan = {}
+
+        for provider in providers:
+            windows = {code: start_dates[code] for code in provider.currencies if code in start_dates}
+
+            if windows:
+                plan.setdefault(provider, {}).update(windows)
+
+        for provider, windows in list(plan.items()):
+            if provider.quote == 'RUB':
+                continue
+
+            quote_provider = self.providers.provider_for(provider.quote)
 
-    def _get_binance_rates(self, symbol: str, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+            if quote_provider is None:
+                print(f"Нет источника курса {provider.quote} для провайдера {provider.name}")
+                continue
+
+            quote_windows = plan.setdefault(quote_provider, {})
+            quote_windows[provider.quote] = min(filter(None, [
+                quote_windows.get(provider.quote), min(windows.values()) - self.QUOTE_LOOKBACK
+            ]))
+
+        return plan
+
+    async def _fetch_all(self, plan: Dict[RateProvider, Dict[str, datetime]], end_date: datetime,
+                         writer: 'RateWriter', quoted: Dict[str, List[CurrencyRate]]) -> List[RateProvider]:
         """
-        Получает курсы криптовалют от Binance.
+        Опрашивает всех провайдеров через общий пул соединений aiohttp.
+
+        Курсы в рублях сразу уходят в writer. Курсы в другой валюте котировки
+        накапливаются до конвертации: для as-of соединения нужен весь ряд котировки.
+        Провайдеры, не успевшие ответить за DEADLINE секунд, отменяются,
+        а их валюты пропускаются до следующего запуска.
 
         Аргументы:
-            symbol (str): Символ криптовалюты для получения курсов.
-            start_date (datetime): Начальная дата для получения курсов.
+            plan (dict): Окна загрузки для каждого провайдера.
             end_date (datetime): Конечная дата для получения курсов.
+            writer (RateWriter): Приёмник курсов в рублях.
+            quoted (dict): Сюда собираются курсы провайдеров не в рублях.
 
         Возвращает:
-            list: Список словарей с данными курсов Binance.
+            list: Провайдеры, загрузка которых завершилась без ошибок и в срок.
         """
-        try:
-            params = {
-                'symbol': self.BINANCE_PAIRS[symbol],
-                'interval': '1d',
-                'startTime': int(start_date.timestamp() * 1000),
-                'endTime': int(end_date.timestamp() * 1000),
-                'limit': 1000
-            }
-
-            response = self.session.get("https://api.binance.com/api/v3/klines", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            print(f"Ошибка при получении курсов Binance для {symbol}: {e}")
+        if not plan:
             return []
 
-    def _convert_crypto_rates(self, symbol: str, klines: List[Dict[str, Any]], usd_rub_rates: Dict[str, float]) -> List[CurrencyRate]:
+        connector = aiohttp.TCPConnector(limit_per_host=self.MAX_CONNECTIONS_PER_HOST)
+        timeout = aiohttp.ClientTimeout(total=self.REQUEST_TIMEOUT)
+
+        async def collect(rates):
+            for rate in rates:
+                quoted[rate.code].append(rate)
+
+        def sink(provider):
+            return writer if provider.quote == 'RUB' else collect
+
+        succeeded = []
+
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.HEADERS) as session:
+                if not self.concurrent:
+                    for provider, windows in plan.items():
+                        try:
+                            await provider.fetch(session, windows, end_date, sink(provider))
+                            succeeded.append(provider)
+                        except Exception as e:
+                            print(f"Ошибка провайдера {provider.name}: {e}")
+
+                    return succeeded
+
+                tasks = {
+                    provider: asyncio.create_task(provider.fetch(session, windows, end_date, sink(provider)))
+                    for provider, windows in plan.items()
+                }
+
+                done, pending = await asyncio.wait(tasks.values(), timeout=self.DEADLINE)
+
+                for task in pending:
+                    task.cancel()
+
+                for provider, task in tasks.items():
+                    if task in pending:
+                        print(f"Превышено время загрузки курсов провайдера {provider.name}")
+                    elif task.exception() is not None:
+                        print(f"Ошибка провайдера {provider.name}: {task.exception()}")
+                    else:
+                        succeeded.append(provider)
+
+            return succeeded
+        finally:
+            # Соединение потока sync_to_async не закрывается обработчиками Celery
+            await sync_to_async(close_old_connections)()
+
+    def _write_converted(self, plan: Dict[RateProvider, Dict[str, datetime]], start_dates: Dict[str, datetime],
+                         quoted: Dict[str, List[CurrencyRate]], writer: 'RateWriter',
+                         succeeded: List[RateProvider]):
+        """
+        Переводит в рубли курсы провайдеров с котировкой не в рублях и передаёт их в writer.
+
+        При неполном ряде котировки конвертация пропускается: as-of соединение
+        подставило бы устаревший курс котировки.
+        """
+        for provider, windows in plan.items():
+            quote_rates = writer.retained.get(provider.quote)
+            quote_provider = self.providers.provider_for(provider.quote)
+
+            if provider.quote == 'RUB' or quote_provider not in succeeded or not quote_rates:
+                continue
+
+            quote_rates = list(quote_rates.values())
+
+            for code in windows:
+                if code in start_dates and code in quoted:
+                    writer.extend(self._convert_quoted_rates(code, quoted.pop(code), quote_rates))
+
+    def _convert_quoted_rates(self, code: str, quoted_rates: List[CurrencyRate],
+                              quote_rates: List[CurrencyRate]) -> List[CurrencyRate]:
         """
-        Конвертирует курсы криптовалют от Binance в рубли с использованием курсов USD/RUB.
+        Конвертирует курсы в валюте котировки в рубли as-of соединением по времени:
+        каждой точке сопоставляется последний курс котировки не позже неё.
+
+        Обе последовательности сортируются и проходятся одним слиянием,
+        без построения строковых ключей для каждой точки.
 
         Аргументы:
-            symbol (str): Символ криптовалюты.
-            klines (list): Список данных курсов Binance.
-            usd_rub_rates (dict): Словарь курсов USD/RUB.
+            code (str): Код валюты.
+            quoted_rates (list): Курсы валюты в валюте котировки.
+            quote_rates (list): Курсы валюты котировки в рублях.
 
         Возвращает:
             list: Список объектов CurrencyRate.
         """
-        try:
-            rates = []
-            for k in klines:
-                date = django_timezone.localtime(datetime.fromtimestamp(k[0] // 1000, tz=timezone.utc))
-                close_usdt = float(k[4])
-                rub = usd_rub_rates.get(date.strftime('%Y-%m-%d'))
-                if rub is not None:
-                    price_rub = close_usdt * rub
-                    rate = CurrencyRate(
-                        currency=symbol,
-                        code=symbol,
-                        price=round(price_rub, 4),
-                        date=date
-                    )
-                    rates.append(rate)
-            return rates
-        except Exception as e:
-            print(f"Ошибка при конвертации курсов для {symbol}: {e}")
-            return []
+        quote_rates = sorted(quote_rates, key=lambda rate: rate.date)
+        rates = []
+        position = -1
+
+        for rate in sorted(quoted_rates, key=lambda rate: rate.date):
+            while position + 1 < len(quote_rates) and quote_rates[position + 1].date <= rate.date:
+                position += 1
+
+            if position >= 0:
+                rates.append(CurrencyRate(
+                    currency=code,
+                    code=code,
+                    price=round(rate.price * quote_rates[position].price, 4),
+                    date=rate.date
+                ))
+
+        return rates
+
+class RateWriter:
+    """
+    Приёмник потока курсов: копит их и записывает пакетами по batch_size строк.
+
+    Запись идемпотентна (вставка с обновлением по (currency, timestamp)), поэтому
+    повторно пришедшие после повтора запроса курсы безопасны. Дубли внутри пакета
+    схлопываются до записи. В памяти одновременно держится не больше одного пакета,
+    а также ряды валют retain, нужные для конвертации котировок.
+
+    Совпадающие с сохранёнными курсы не перезаписываются, а изменёнными считаются
+    только строки, которые вернул RETURNING: перекрытие окна загрузки само по себе
+    не обновляет кэши и агрегаты.
+
+    Атрибуты:
+        currencies (dict): Валюты по коду, курсы которых сохраняются.
+        batch_size (int): Размер пакета записи.
+        retained (dict): Курсы валют retain по дате.
+        updated (dict): Для каждой валюты с новыми или изменёнными курсами - самое раннее их время.
+    """
+
+    def __init__(self, currencies: Dict[str, Currency], batch_size: int, retain: Iterable[str] = ()):
+        self.currencies = currencies
+        self.batch_size = batch_size
+        self.retained: Dict[str, Dict[datetime, CurrencyRate]] = {code: {} for code in retain}
+        self.updated: Dict[int, datetime] = {}
+        self._pending: Dict[Tuple[int, datetime], float] = {}
+
+    async def __call__(self, rates: List[CurrencyRate]):
+        self._add(rates)
+
+        if len(self._pending) >= self.batch_size:
+            # Запись в базу выполняется вне цикла событий, пока остальные ответы продолжают разбираться.
+            # Поток sync_to_async пишет своим соединением в автофиксации, вне транзакций вызывающего
+            await sync_to_async(self._write)(self._take())
+
+    def extend(self, rates: Iterable[CurrencyRate]):
+        """
+        Синхронный вариант приёма курсов для кода вне цикла событий.
+        """
+        for rate in rates:
+            self._add([rate])
+
+            if len(self._pending) >= self.batch_size:
+                self._write(self._take())
+
+    @property
+    def updated_currency_ids(self) -> set:
+        return set(self.updated)
+
+    def flush(self):
+        self._write(self._take())
+
+    def _add(self, rates: List[CurrencyRate]):
+        for rate in rates:
+            if rate.code in self.retained:
+                self.retained[rate.code][rate.date] = rate
+
+            currency = self.currencies.get(rate.code)
+
+            if currency is not None:
+                self._pending[(currency.id, rate.date)] = rate.price
+
+    def _take(self) -> Dict[Tuple[int, datetime], float]:
+        batch, self._pending = self._pending, {}
+
+        return batch
+
+    def _write(self, batch: Dict[Tuple[int, datetime], float]):
+        if not batch:
+            return
+
+        table = connection.ops.quote_name(Rate._meta.db_table)
+        keys = list(batch)
+
+        # Идемпотентная вставка: перекрывающиеся окна обновляют только отличающиеся курсы
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {table} AS rate (currency_id, cost, "timestamp")
+                SELECT * FROM unnest(%s::bigint[], %s::double precision[], %s::timestamptz[])
+                ON CONFLICT (currency_id, "timestamp") DO UPDATE SET cost = EXCLUDED.cost
+                WHERE rate.cost IS DISTINCT FROM EXCLUDED.cost
+                RETURNING currency_id, "timestamp"
+            ''', [[currency_id for currency_id, _ in keys], [batch[key] for key in keys],
+                  [timestamp for _, timestamp in keys]])
+
+            for currency_id, timestamp in cursor.fetchall():
+                if currency_id not in self.updated or timestamp < self.updated[currency_id]:
+                    self.updated[currency_id] = timestamp
+
 
 @shared_task
 def update_currency_rates():
@@ -207,48 +392,44 @@ def update_currency_rates():
     try:
         service = CurrencyRatesService()
         end_date = django_timezone.now()
-
-        # Получение последнего временного штампа для каждой валюты        # Проверяем наличие данных в кэше
-        latest_rates = cache.get('latest_rates')
-        if not latest_rates:
-            # Инициализируем пустой словарь для хранения временных штампов
-            latest_rates = {}
-            for code in list(CurrencyRatesService.CBR_CODES.keys()) + list(CurrencyRatesService.BINANCE_PAIRS.keys()):
-                # Фильтруем записи по краткому названию валюты
-                latest_rate = Rate.objects.filter(
-                    currency__short_name=code
-                # Получаем последнюю запись по временной метке
-                ).order_by('-timestamp').first()
-                # Сохраняем временную метку или None, если записи нет
-                latest_rates[code] = latest_rate.timestamp if latest_rate else None
-            # Сохраняем данные в кэш с таймаутом 3600 секунд
-            cache.set('latest_rates', latest_rates, timeout=3600)
-
-        # Установка начальной даты на основе последних данных или по умолчанию на 365 дней
-        start_date = end_date - timedelta(days=365)
-        rates = service.get_rates(start_date, end_date)
-
-        with transaction.atomic():
-            for currency_code, currency_rates in rates.items():
-                currency = Currency.objects.select_related().get(short_name=currency_code)
-                latest_timestamp = latest_rates.get(currency_code)
-
-                # Фильтрация новых данных
-                new_rates = [rate for rate in currency_rates if not latest_timestamp or rate.date > latest_timestamp]
-
-                # Пакетная вставка новых курсов
-                Rate.objects.bulk_create([
-                    Rate(
-                        currency=currency,
-                        cost=rate.price,
-                        timestamp=rate.date
-                    ) for rate in new_rates
-                ])
+        providers = service.due_providers(end_date)
+
+        if not providers:
+            return True
+
+        # Получение всех валют одним запросом и последних временных штампов из общего кэша курсов
+        currencies = {
+            currency.short_name: currency
+            for currency in Currency.objects.filter(
+                short_name__in=[code for provider in providers for code in provider.currencies]
+            )
+        }
+        cached_rates = latest_rates.get_many(currency.id for currency in currencies.values())
+        latest_timestamps = {
+            code: cached_rates[currency.id].timestamp if currency.id in cached_rates else None
+            for code, currency in currencies.items()
+        }
+
+        # Запрос только новых данных после последнего курса каждой валюты,
+        # полная загрузка - только для валют без курсов
+        start_dates = service.get_start_dates(latest_timestamps, end_date)
+        writer, succeeded = service.load_rates(currencies, start_dates, end_date, providers)
+        updated_currency_ids = writer.updated_currency_ids
+
+        if updated_currency_ids:
+            with transaction.atomic():
+                # Пересчёт OHLC-агрегатов только начиная с корзины самого раннего изменённого курса
+                rate_rollups.update(writer.updated)
+
+                # Обновление кэша последних курсов и графиков после фиксации транзакции
+                transaction.on_commit(lambda: latest_rates.refresh(updated_currency_ids))
+                transaction.on_commit(lambda: valuations.apply_rates(updated_currency_ids))
+                transaction.on_commit(lambda: cache.delete('chart_data'))
+
+        # Провайдеры с ошибками или превысившие DEADLINE повторяются при следующем запуске
+        service.mark_run([provider for provider in providers if provider in succeeded], end_date)
 
         return True
     except Exception as e:
         print(f"Ошибка при обновлении курсов валют: {e}")
         return False
-    finally:
-        if 'service' in locals():
-            del service
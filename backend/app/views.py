@@ -6,10 +6,12 @@ from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import FormView, TemplateView
 from rest_framework_simplejwt.tokens import RefreshToken
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
 from django.utils import timezone
 from django.core.cache import cache
 
+from api.rates import latest_rates
+from api.trading import TradeError, trades
+from api.valuation import valuations
 from api.serializers import *
 from .forms import *
 
@@ -127,19 +129,9 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     login_url = 'app:login'
 
     def _calculate_portfolio_value(self, portfolio):
-        total_value = portfolio.balance
-        actives = 0
-        
-        for currency_balance in CurrencyBalance.objects.filter(portfolio=portfolio).select_related('currency'):
-            try:
-                current_rate = currency_balance.currency.rate_set.latest('timestamp')
-                currency_value = currency_balance.amount * current_rate.cost
-                actives += currency_value
-                total_value += currency_value
-            except Rate.DoesNotExist:
-                continue
-                
-        return total_value, actives
+        valuation = valuations.get(portfolio.id)
+
+        return valuation.total, valuation.holdings_value
 
     def _get_portfolio_change(self, portfolio, current_value):
         try:
@@ -149,35 +141,44 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             return None
 
     def get(self, request, *args, **kwargs):
-        portfolio = get_object_or_404(Portfolio, account=request.user)
-        
+        portfolio = get_object_or_404(Portfolio.objects.with_summary(), account=request.user)
+        currencies = list(Currency.objects.all())
+
+        # Последние курсы загружаются один раз и передаются всем сериализаторам
+        rates = latest_rates.get_many(currency.id for currency in currencies)
+        serializer_context = {'latest_rates': rates}
+
         total_value, actives = self._calculate_portfolio_value(portfolio)
         
         change_percent = self._get_portfolio_change(portfolio, total_value)
         
         context = {
-            'portfolio': PortfolioSerializer(portfolio).data,
+            'portfolio': PortfolioSerializer(portfolio, context=serializer_context).data,
             'currency_balances': CurrencyBalanceSerializer(
-                CurrencyBalance.objects.filter(portfolio=portfolio),
-                many=True
+                CurrencyBalance.objects.filter(portfolio=portfolio).select_related('currency'),
+                many=True,
+                context=serializer_context
             ).data,
             'actives': actives,
             'total_value': total_value,
             'change_percent': change_percent,
             'operations': OperationSerializer(
-                Operation.objects.filter(portfolio=portfolio),
-                many=True
+                Operation.objects.filter(portfolio=portfolio).with_portfolio_summary(),
+                many=True,
+                context=serializer_context
             ).data,
             'watches': WatchSerializer(
-                Watch.objects.filter(portfolio=portfolio),
-                many=True
+                Watch.objects.filter(portfolio=portfolio).with_portfolio_summary(),
+                many=True,
+                context=serializer_context
             ).data,
             'buy_form': PortfolioOperationForm(),
             'sell_form': PortfolioOperationForm(),
             'watch_form': WatchForm(),
             'currencies': CurrencySerializer(
-                Currency.objects.all(),
-                many=True
+                currencies,
+                many=True,
+                context=serializer_context
             ).data,
             'chart_data': self._prepare_chart_data()
         }
@@ -199,13 +200,15 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             return cached_chart_data
 
         for currency in Currency.objects.all():
-            # Ограничение количества записей для графиков
-            rates = Rate.objects.filter(currency=currency).order_by('-timestamp')[:100]
-            rate_serializer = RateSerializer(rates, many=True)
+            # Дневные OHLC-агрегаты вместо сырых курсов, ограничение количества точек для графиков
+            rollups = RateRollup.objects.filter(
+                currency=currency,
+                resolution=RateRollup.Resolution.DAY
+            ).order_by('-bucket')[:100]
 
             chart_data[currency.short_name] = {
-                'labels': [rate['timestamp'] for rate in rate_serializer.data],
-                'values': [float(rate['cost']) for rate in rate_serializer.data]
+                'labels': [timezone.localtime(rollup.bucket).strftime('%Y-%m-%d') for rollup in rollups],
+                'values': [float(rollup.close) for rollup in rollups]
             }
 
         # Сохранение данных в кэш
@@ -226,69 +229,19 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         return redirect('app:dashboard')
 
     def _handle_buy(self, request, portfolio):
-        form = PortfolioOperationForm(request.POST)
-
-        if form.is_valid():
-            currency = form.cleaned_data['currency']
-            amount = form.cleaned_data['amount']
-
-            rate = Rate.objects.filter(currency=currency).latest('timestamp')
-            price = rate.cost
-            total_cost = price * amount
-
-            if portfolio.balance >= total_cost:
-                operation = Operation.objects.create(
-                    portfolio=portfolio,
-                    currency=currency,
-                    amount=amount,
-                    price=price,
-                    operation_type='buy'
-                )
-
-                portfolio.balance -= total_cost
-                portfolio.save()
-
-                balance, created = CurrencyBalance.objects.get_or_create(
-                    portfolio=portfolio,
-                    currency=currency,
-                    defaults={'amount': amount}
-                )
-
-                if not created:
-                    balance.amount += amount
-                    balance.save()
-
-        return redirect('app:dashboard')
+        return self._handle_trade(request, portfolio, trades.buy)
 
     def _handle_sell(self, request, portfolio):
+        return self._handle_trade(request, portfolio, trades.sell)
+
+    def _handle_trade(self, request, portfolio, execute):
         form = PortfolioOperationForm(request.POST)
 
         if form.is_valid():
-            currency = form.cleaned_data['currency']
-            amount = form.cleaned_data['amount']
-
-            balance = get_object_or_404(CurrencyBalance, portfolio=portfolio, currency=currency)
-            if balance.amount >= amount:
-                rate = Rate.objects.filter(currency=currency).latest('timestamp')
-                price = rate.cost
-                total_cost = price * amount
-
-                operation = Operation.objects.create(
-                    portfolio=portfolio,
-                    currency=currency,
-                    amount=amount,
-                    price=price,
-                    operation_type='sell'
-                )
-
-                portfolio.balance += total_cost
-                portfolio.save()
-
-                balance.amount -= amount
-                if abs(balance.amount) < 1e-10:
-                    balance.delete()
-                else:
-                    balance.save()
+            try:
+                execute(portfolio.id, form.cleaned_data['currency'], form.cleaned_data['amount'])
+            except TradeError:
+                pass
 
         return redirect('app:dashboard')
 
@@ -296,28 +249,10 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         form = WatchForm(request.POST)
 
         if form.is_valid():
-            watch = Watch.objects.create(
+            Watch.objects.create(
                 portfolio=portfolio,
                 currency=form.cleaned_data['currency'],
                 notify_time=form.cleaned_data['notify_time']
             )
 
-            portfolio.watches.add(watch)
-
-            schedule, _ = CrontabSchedule.objects.get_or_create(
-                hour=watch.notify_time.hour,
-                minute=watch.notify_time.minute,
-                day_of_week='*',
-                day_of_month='*',
-                month_of_year='*',
-            )
-
-            PeriodicTask.objects.create(
-                name=f'notify-{watch.id}',
-                task='api.tasks.notify_currency_rate',
-                crontab=schedule,
-                args=[watch.id],
-                enabled=True
-            )
-
         return redirect('app:dashboard')
@@ -178,6 +178,65 @@ async function fetchRatesFromAPI() {
     }
 }
 
+// Идентификаторы валют по коду: кнопки графика знают только код, а история курсов запрашивается по id
+const currencyIds = {};
+// Дневных точек за ~13 лет, столько же разрешает RATES_MAX_PAGE_SIZE по умолчанию
+const CHART_PAGE_SIZE = 5000;
+
+async function getCurrencyId(shortName) {
+    if (!(shortName in currencyIds)) {
+        const response = await fetch('/api/v1/currencies/');
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        (await response.json()).forEach(currency => {
+            currencyIds[currency.short_name] = currency.id;
+        });
+    }
+
+    if (!(shortName in currencyIds)) {
+        throw new Error(`Валюта ${shortName} не найдена`);
+    }
+
+    return currencyIds[shortName];
+}
+
+function chartRangeStart(interval) {
+    const start = new Date();
+
+    if (interval === '1m') {
+        start.setMonth(start.getMonth() - 1);
+    } else if (interval === '1y') {
+        start.setFullYear(start.getFullYear() - 1);
+    } else if (interval === '3y') {
+        start.setFullYear(start.getFullYear() - 3);
+    } else {
+        return null;
+    }
+
+    return start;
+}
+
+// График строится по дневным агрегатам за выбранный период, а не по всей истории сырых курсов
+async function fetchDailyRates(shortName, interval) {
+    const currencyId = await getCurrencyId(shortName);
+    const params = new URLSearchParams({ resolution: 'day', fields: 'bucket,close', page_size: CHART_PAGE_SIZE });
+    const from = chartRangeStart(interval);
+
+    if (from) {
+        params.set('from', from.toISOString());
+    }
+
+    const response = await fetch(`/api/v1/currencies/${currencyId}/rates/?${params}`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const page = await response.json();
+
+    // API отдаёт корзины от новых к старым
+    return page.results.reverse();
+}
+
 async function getBTCPriceFromBinance() {
   try {
     const btcUsdtResponse = await fetch('https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT');
@@ -480,44 +539,11 @@ function updateCombinedChartForSingleCurrency(selectedCurrency, interval) { // i
     }
 
     // Используем API для получения данных вместо файла
-    fetch(`/api/v1/rates/?short_name=${selectedCurrency}`)
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            return response.json();
-        })
+    fetchDailyRates(selectedCurrency, interval)
         .then(ratesData => {
             // Преобразуем данные из API в формат для графика
-            const labels = [];
-            const values = [];
-            
-            // Сортируем данные по дате (от старых к новым)
-            ratesData.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
-            
-            // Фильтруем данные в зависимости от выбранного интервала
-            let filteredData = ratesData;
-            const now = new Date();
-            
-            if (interval === '1m') {
-                const oneMonthAgo = new Date(now);
-                oneMonthAgo.setMonth(now.getMonth() - 1);
-                filteredData = ratesData.filter(item => new Date(item.timestamp) >= oneMonthAgo);
-            } else if (interval === '1y') {
-                const oneYearAgo = new Date(now);
-                oneYearAgo.setFullYear(now.getFullYear() - 1);
-                filteredData = ratesData.filter(item => new Date(item.timestamp) >= oneYearAgo);
-            } else if (interval === '3y') {
-                const threeYearsAgo = new Date(now);
-                threeYearsAgo.setFullYear(now.getFullYear() - 3);
-                filteredData = ratesData.filter(item => new Date(item.timestamp) >= threeYearsAgo);
-            }
-            
-            // Извлекаем метки и значения
-            filteredData.forEach(rate => {
-                labels.push(rate.timestamp);
-                values.push(rate.cost);
-            });
+            const labels = ratesData.map(rate => rate.bucket.slice(0, 10));
+            const values = ratesData.map(rate => rate.close);
             
             // Создаем набор данных для графика
             const dataset = {